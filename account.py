@@ -0,0 +1,187 @@
+"""Whole-account export and deletion.
+
+The export is a zip archive with one JSON lines file per table, generated while
+it is being sent: rows are read in chunks and every compressed chunk is handed
+to the response as soon as it is written, so memory use doesn't depend on the
+size of the account.
+
+Deleting an account removes every row carrying the user's id, children first
+and in batches of primary keys, and then the users row itself, so it doesn't
+depend on the foreign keys having ON DELETE CASCADE. That can still take a
+while for heavy users, so it runs on a background thread instead of the request.
+The user is marked with deletion_requested_at first, which locks them out right
+away; deletions that a restart or an error interrupted are finished with
+`flask --app main finish-account-deletions` (e.g. from cron).
+Databases created before the foreign keys had ON DELETE CASCADE can still be
+upgraded with `flask --app main cascade-user-foreign-keys` (PostgreSQL only).
+"""
+import json
+import logging
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from decimal import Decimal
+
+import click
+from flask import current_app
+from sqlalchemy import delete, inspect, select, text
+
+from app import app, db
+from archive import iter_expenses_for_export
+from models import Budget, Category, RecurringExpense, ShardAssignment, User
+from sharding import DEFAULT_SHARD, SHARDED_TABLES, shard_engine
+
+EXPORT_CHUNK_SIZE = 64 * 1024  # Compressed bytes collected before they are sent
+DELETE_BATCH_SIZE = 5000  # Rows deleted per transaction
+EXCLUDED_EXPORT_COLUMNS = {'user_id', 'password_hash'}
+
+# One worker is enough, deletions are rare and mostly wait on the database
+_deletion_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='account-deletion')
+
+class _ZipStream:
+    """Write-only file object collecting the bytes zipfile writes"""
+
+    def __init__(self):
+        self._chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        self.size = 0
+        return data
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"Can't export {type(value).__name__}")
+
+def _row_data(row):
+    return {
+        column.key: getattr(row, column.key)
+        for column in inspect(row).mapper.column_attrs
+        if column.key not in EXCLUDED_EXPORT_COLUMNS
+    }
+
+def _export_sections(user_id):
+    yield 'account', [db.session.get(User, user_id)]
+    for name, model in (('categories', Category), ('budgets', Budget), ('recurring_expenses', RecurringExpense)):
+        yield name, model.query.filter_by(user_id=user_id).order_by(model.id).yield_per(1000)
+    # Current and archived expenses
+    yield 'expenses', iter_expenses_for_export(user_id)
+
+def iter_account_export(user_id):
+    """Yield a zip archive of all of a user's data, chunk by chunk"""
+    stream = _ZipStream()
+    # zipfile falls back to data descriptors because the stream can't seek
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, rows in _export_sections(user_id):
+            with archive.open(f'{name}.jsonl', 'w', force_zip64=True) as f:
+                for row in rows:
+                    f.write(json.dumps(_row_data(row), default=_json_default).encode('utf-8') + b'\n')
+                    if stream.size >= EXPORT_CHUNK_SIZE:
+                        yield stream.drain()
+    yield stream.drain()
+
+def deleting_user_ids():
+    """Get the ids of the users whose accounts are waiting to be deleted"""
+    return set(db.session.scalars(select(User.id).where(User.deletion_requested_at.is_not(None))))
+
+def _delete_user_rows(engine, tables, user_id):
+    """Delete a user's rows from `tables`, in order, a batch per transaction"""
+    for table in tables:
+        if 'id' not in table.c:
+            # One row per user, keyed by user_id
+            with engine.begin() as conn:
+                conn.execute(delete(table).where(table.c.user_id == user_id))
+            continue
+        while True:
+            with engine.begin() as conn:
+                ids = conn.execute(
+                    select(table.c.id).where(table.c.user_id == user_id).limit(DELETE_BATCH_SIZE)
+                ).scalars().all()
+                if not ids:
+                    break
+                conn.execute(delete(table).where(table.c.user_id == user_id, table.c.id.in_(ids)))
+
+def delete_account(user_id):
+    """Delete a user and all of their data"""
+    assignment = db.session.get(ShardAssignment, user_id)
+    shard_key = assignment.shard_key if assignment else DEFAULT_SHARD
+
+    # The deletion marker already stops new rows from being created for the user
+    if shard_key != DEFAULT_SHARD:
+        _delete_user_rows(shard_engine(shard_key), [db.metadata.tables[name] for name in reversed(SHARDED_TABLES)], user_id)
+
+    # Children before parents, so it works whether or not the foreign keys cascade
+    main_tables = [
+        table for table in reversed(db.metadata.sorted_tables)
+        if table.name != User.__tablename__ and 'user_id' in table.c
+    ]
+    _delete_user_rows(db.engine, main_tables, user_id)
+
+    # Removing the users row last keeps the marker until everything else is gone
+    db.session.execute(delete(User).where(User.id == user_id))
+    db.session.commit()
+
+def _run_account_deletion(flask_app, user_id):
+    with flask_app.app_context():
+        try:
+            delete_account(user_id)
+            logging.info("Deleted account %s", user_id)
+        except Exception:
+            db.session.rollback()
+            logging.exception("Could not delete account %s, finish-account-deletions will retry", user_id)
+
+def schedule_account_deletion(user_id):
+    """Mark an account for deletion and delete it on the background thread"""
+    user = db.session.get(User, user_id)
+    user.deletion_requested_at = datetime.now()
+    db.session.commit()
+    return _deletion_executor.submit(_run_account_deletion, current_app._get_current_object(), user_id)
+
+@app.cli.command('finish-account-deletions')
+def finish_account_deletions_command():
+    """Delete the accounts whose deletion was requested but never finished."""
+    deleted = 0
+    for user_id in sorted(deleting_user_ids()):
+        try:
+            delete_account(user_id)
+            deleted += 1
+        except Exception:
+            db.session.rollback()
+            logging.exception("Could not delete account %s", user_id)
+    click.echo(f"Deleted {deleted} accounts")
+
+@app.cli.command('cascade-user-foreign-keys')
+def cascade_user_foreign_keys_command():
+    """Recreate foreign keys to users with ON DELETE CASCADE (PostgreSQL only)."""
+    if db.engine.dialect.name != 'postgresql':
+        raise click.ClickException("Foreign keys can only be altered on PostgreSQL")
+
+    with db.engine.begin() as conn:
+        inspector = inspect(conn)
+        updated = 0
+        for table_name in inspector.get_table_names():
+            for fk in inspector.get_foreign_keys(table_name):
+                if fk['referred_table'] != 'users' or fk['options'].get('ondelete', '').upper() == 'CASCADE':
+                    continue
+                columns = ', '.join(fk['constrained_columns'])
+                referred = ', '.join(fk['referred_columns'])
+                conn.execute(text(f'ALTER TABLE {table_name} DROP CONSTRAINT "{fk["name"]}"'))
+                conn.execute(text(
+                    f'ALTER TABLE {table_name} ADD CONSTRAINT "{fk["name"]}" '
+                    f'FOREIGN KEY ({columns}) REFERENCES users ({referred}) ON DELETE CASCADE'
+                ))
+                updated += 1
+    click.echo(f"Updated {updated} foreign keys")
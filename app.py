@@ -1,23 +1,38 @@
 import os
+import sqlite3
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
 import logging
-
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+from log_setup import init_logging
+from sharding import ShardedSession, init_sharding, create_shard_tables, check_shard_assignments
+from assets import init_assets
+from templating import init_templating
+from schema import init_schema, upgrade_schema
+from events import init_events
+from money import init_money, check_money_storage
 
 class Base(DeclarativeBase):
     pass
 
-db = SQLAlchemy(model_class=Base)
+db = SQLAlchemy(model_class=Base, session_options={'class_': ShardedSession})
 
 # create the app
 app = Flask(__name__)
+# Structured, queued log output and sampled request logs (see log_setup.py for LOG_* settings)
+init_logging(app)
 app.secret_key = os.environ.get("SESSION_SECRET")
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1) # needed for url_for to generate with https
 
+# Fingerprinted, long-lived static URLs and gzip/brotli compression
+init_assets(app)
+
+# Template fragment cache, shared bytecode cache and render timing
+init_templating(app)
+
 # configure the database, relative to the app instance folder
 app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
 app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
@@ -26,11 +41,33 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
 }
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
+@event.listens_for(Engine, "connect")
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    # SQLite only enforces foreign keys (and ON DELETE CASCADE) when asked to
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.execute("PRAGMA foreign_keys = ON")
+
+# Optionally spread tenant data over extra databases (SHARD_DATABASE_URLS)
+init_sharding(app, db)
+
 # initialize the app with the extension, flask-sqlalchemy >= 3.0.x
 db.init_app(app)
 
+# Live per-user change events (EVENT_BROKER selects the cross-worker backend)
+init_events(app, db)
+
+# Decimal money values as JSON numbers; MONEY_STORAGE selects NUMERIC or integer cents columns
+init_money(app, db)
+
+# Column upgrades run below; indexes added to existing tables are built with create-indexes
+init_schema(app, db)
+
 with app.app_context():
     # Make sure to import the models here or their tables won't be created
     import models  # noqa: F401
     db.create_all()
+    create_shard_tables(app, db)
+    upgrade_schema(db)
+    check_shard_assignments(db)
+    check_money_storage()
     logging.info("Database tables created")
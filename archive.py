@@ -0,0 +1,210 @@
+"""Cold-data archival and optional yearly partitioning of the expenses table.
+
+Closed years are moved out of `expenses` with `flask --app main archive-expenses`:
+raw rows go to `expenses_archive` and per-month, per-category totals go to
+`expense_summaries`, so the hot table only holds current data. The read helpers
+below pick the right table for a period so routes never need to care.
+
+On PostgreSQL, `flask --app main partition-expenses` converts `expenses` into a
+table range-partitioned by `date` with one partition per year. All routes filter
+on half-open date ranges (see year_bounds/month_bounds) so the planner can prune
+partitions and use the (user_id, date) index.
+"""
+import logging
+from datetime import date
+
+import click
+from sqlalchemy import delete, extract, func, insert, literal, select, text
+
+from app import app, db
+from models import ArchivedYear, Expense, ExpenseArchive, ExpenseSummary
+from sharding import DEFAULT_SHARD, all_shards, shard_engine, use_shard
+
+ARCHIVED_COLUMNS = ['amount', 'description', 'date', 'user_id', 'category_id', 'created_at', 'updated_at']
+
+def year_bounds(year):
+    """Get the half-open [start, end) date range covering a year"""
+    return date(year, 1, 1), date(year + 1, 1, 1)
+
+def month_bounds(year, month):
+    """Get the half-open [start, end) date range covering a month"""
+    if month == 12:
+        return date(year, 12, 1), date(year + 1, 1, 1)
+    return date(year, month, 1), date(year, month + 1, 1)
+
+def is_archived_year(year):
+    """Check whether a year has been moved to the archive"""
+    return db.session.get(ArchivedYear, year) is not None
+
+def expenses_between(user_id, start, end):
+    """Get a user's expenses with start <= date < end (within one year), newest first"""
+    expenses = Expense.query.filter(
+        Expense.user_id == user_id,
+        Expense.date >= start,
+        Expense.date < end
+    ).order_by(Expense.date.desc()).all()
+
+    if not is_archived_year(start.year):
+        return expenses
+
+    # Late entries for a closed year stay in the hot table until the next archive run
+    archived = ExpenseArchive.query.filter(
+        ExpenseArchive.user_id == user_id,
+        ExpenseArchive.date >= start,
+        ExpenseArchive.date < end
+    ).order_by(ExpenseArchive.date.desc()).all()
+    return sorted(expenses + archived, key=lambda expense: expense.date, reverse=True)
+
+def monthly_totals(user_id, year):
+    """Get a {month: total} mapping for a user's year, using summary rows for archived years"""
+    start, end = year_bounds(year)
+    month = extract('month', Expense.date)
+    totals = {int(m): total for m, total in db.session.query(month, func.sum(Expense.amount)).filter(
+        Expense.user_id == user_id,
+        Expense.date >= start,
+        Expense.date < end
+    ).group_by(month).all()}
+
+    if is_archived_year(year):
+        archived = db.session.query(ExpenseSummary.month, func.sum(ExpenseSummary.total)).filter(
+            ExpenseSummary.user_id == user_id,
+            ExpenseSummary.year == year
+        ).group_by(ExpenseSummary.month).all()
+        for m, total in archived:
+            totals[m] = totals.get(m, 0) + total
+
+    return totals
+
+def iter_expenses_for_export(user_id, year=None, month=None):
+    """Yield a user's expenses for the CSV export, hot rows first, then archived rows"""
+    models = [Expense]
+    if year is None or is_archived_year(year):
+        models.append(ExpenseArchive)
+
+    for model in models:
+        query = model.query.filter(model.user_id == user_id)
+        if year is not None:
+            start, end = month_bounds(year, month) if month else year_bounds(year)
+            query = query.filter(model.date >= start, model.date < end)
+        # Stream in chunks instead of loading every row at once
+        yield from query.order_by(model.date.desc()).yield_per(1000)
+
+def archive_year(year):
+    """Move a closed year's expenses to the archive and rebuild its summary rows"""
+    start, end = year_bounds(year)
+    expenses = Expense.__table__
+    archive = ExpenseArchive.__table__
+    summaries = ExpenseSummary.__table__
+
+    in_year = (expenses.c.date >= start) & (expenses.c.date < end)
+    moved = db.session.execute(insert(archive).from_select(
+        ARCHIVED_COLUMNS,
+        select(*[expenses.c[name] for name in ARCHIVED_COLUMNS]).where(in_year)
+    )).rowcount
+    db.session.execute(delete(expenses).where(in_year))
+
+    # Recompute rather than increment, so re-running after late entries stays correct
+    db.session.execute(delete(summaries).where(summaries.c.year == year))
+    month = extract('month', archive.c.date)
+    db.session.execute(insert(summaries).from_select(
+        ['user_id', 'category_id', 'year', 'month', 'total', 'count'],
+        select(
+            archive.c.user_id,
+            archive.c.category_id,
+            literal(year),
+            month,
+            func.sum(archive.c.amount),
+            func.count()
+        ).where(
+            archive.c.date >= start,
+            archive.c.date < end
+        ).group_by(archive.c.user_id, archive.c.category_id, month)
+    ))
+
+    if not is_archived_year(year):
+        db.session.add(ArchivedYear(year=year))
+    db.session.commit()
+    return moved
+
+@app.cli.command('archive-expenses')
+@click.option('--before', 'before_year', type=int, default=None,
+              help='Archive every year before this one (defaults to the current year).')
+def archive_expenses_command(before_year):
+    """Move expenses of closed years to the archive table."""
+    before_year = before_year or date.today().year
+    for shard_key in all_shards():
+        with use_shard(shard_key):
+            oldest = db.session.query(func.min(Expense.date)).filter(
+                Expense.date < date(before_year, 1, 1)
+            ).scalar()
+            if oldest is None:
+                click.echo(f"{shard_key}: nothing to archive")
+                continue
+
+            for year in range(oldest.year, before_year):
+                try:
+                    moved = archive_year(year)
+                except Exception:
+                    db.session.rollback()
+                    raise
+                logging.info("Archived %d expenses from %d on %s", moved, year, shard_key)
+                click.echo(f"{shard_key} {year}: archived {moved} expenses")
+
+def _create_year_partitions(conn, first_year, last_year):
+    for year in range(first_year, last_year + 1):
+        start, end = year_bounds(year)
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS expenses_y{year} PARTITION OF expenses "
+            f"FOR VALUES FROM ('{start}') TO ('{end}')"
+        ))
+
+@app.cli.command('partition-expenses')
+@click.option('--years-ahead', default=1, show_default=True,
+              help='Also create partitions for this many future years.')
+def partition_expenses_command(years_ahead):
+    """Range-partition the expenses table by year on every shard (PostgreSQL only)."""
+    for shard_key in all_shards():
+        engine = shard_engine(shard_key)
+        if engine.dialect.name != 'postgresql':
+            raise click.ClickException("Native partitioning is only available on PostgreSQL")
+        with engine.begin() as conn:
+            click.echo(f"{shard_key}: {_partition_expenses(conn, shard_key, years_ahead)}")
+
+def _partition_expenses(conn, shard_key, years_ahead):
+    this_year = date.today().year
+    is_partitioned = conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'expenses'::regclass"
+    )).scalar()
+
+    if is_partitioned:
+        # Already converted: only add partitions for upcoming years
+        _create_year_partitions(conn, this_year, this_year + years_ahead)
+        return "partitions are up to date"
+
+    oldest = conn.execute(select(func.min(Expense.__table__.c.date))).scalar()
+    first_year = oldest.year if oldest else this_year
+
+    conn.execute(text("ALTER TABLE expenses RENAME TO expenses_unpartitioned"))
+    sequence = conn.execute(text(
+        "SELECT pg_get_serial_sequence('expenses_unpartitioned', 'id')"
+    )).scalar()
+    conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY NONE"))
+    conn.execute(text(
+        "CREATE TABLE expenses (LIKE expenses_unpartitioned INCLUDING DEFAULTS) "
+        "PARTITION BY RANGE (date)"
+    ))
+    # The partition key has to be part of the primary key
+    conn.execute(text("ALTER TABLE expenses ADD CONSTRAINT expenses_partitioned_pkey PRIMARY KEY (id, date)"))
+    conn.execute(text("ALTER TABLE expenses ADD FOREIGN KEY (category_id) REFERENCES categories (id)"))
+    if shard_key == DEFAULT_SHARD:
+        # The users table only exists in the main database
+        conn.execute(text("ALTER TABLE expenses ADD FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE"))
+    _create_year_partitions(conn, first_year, this_year + years_ahead)
+    conn.execute(text("CREATE TABLE expenses_default PARTITION OF expenses DEFAULT"))
+    conn.execute(text("INSERT INTO expenses SELECT * FROM expenses_unpartitioned"))
+    conn.execute(text("DROP TABLE expenses_unpartitioned"))
+    conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY expenses.id"))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_expenses_user_id_date ON expenses (user_id, date)"
+    ))
+    return f"partitioned expenses by year from {first_year} to {this_year + years_ahead}"
@@ -0,0 +1,138 @@
+"""Fingerprinted static assets and response compression.
+
+Every file in the static folder is hashed once at startup. `url_for('static', ...)`
+then adds the content hash as a `v` query parameter, and requests carrying the
+current hash are served with a far-future immutable Cache-Control header, so
+browsers only fetch an asset again after it changed. Compressed variants of the
+static files are also built at startup.
+
+Text responses above COMPRESS_MIN_SIZE bytes are compressed on the fly with
+brotli (when installed) or gzip, depending on what the client accepts.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+
+from flask import request
+from flask.sessions import SecureCookieSessionInterface
+
+try:
+    import brotli
+except ImportError:  # Optional dependency, gzip is used without it
+    brotli = None
+
+COMPRESSIBLE_TYPES = (
+    'text/html',
+    'text/css',
+    'text/plain',
+    'text/csv',
+    'text/javascript',
+    'application/javascript',
+    'application/json',
+    'image/svg+xml',
+)
+
+STATIC_MAX_AGE = 365 * 24 * 60 * 60  # One year
+
+def _compress(data, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(data, quality=min(level + 3, 11))
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+def _is_compressible(mimetype):
+    return mimetype in COMPRESSIBLE_TYPES
+
+def _supported_encodings():
+    return ('br', 'gzip') if brotli else ('gzip',)
+
+def _preferred_encoding():
+    """Pick the best encoding the client accepts, if any"""
+    for encoding in _supported_encodings():
+        if request.accept_encodings[encoding]:
+            return encoding
+    return None
+
+class StaticSessionInterface(SecureCookieSessionInterface):
+    """Cookie sessions that leave static responses alone, keeping them cacheable"""
+
+    def save_session(self, app, session, response):
+        if request.endpoint == 'static':
+            return
+        super().save_session(app, session, response)
+
+def build_static_manifest(static_folder, level=9):
+    """Hash every static file and precompress the text ones"""
+    manifest = {}
+    precompressed = {}
+    for root, _, files in os.walk(static_folder):
+        for name in files:
+            path = os.path.join(root, name)
+            filename = os.path.relpath(path, static_folder).replace(os.sep, '/')
+            with open(path, 'rb') as f:
+                data = f.read()
+            manifest[filename] = hashlib.sha256(data).hexdigest()[:12]
+
+            if _is_compressible(mimetypes.guess_type(name)[0]):
+                variants = {}
+                for encoding in _supported_encodings():
+                    compressed = _compress(data, encoding, level)
+                    if len(compressed) < len(data):
+                        variants[encoding] = compressed
+                precompressed[filename] = variants
+    return manifest, precompressed
+
+def init_assets(app):
+    """Set up static fingerprinting and response compression"""
+    min_size = int(os.environ.get('COMPRESS_MIN_SIZE', 500))
+    level = int(os.environ.get('COMPRESS_LEVEL', 6))
+    manifest, precompressed = build_static_manifest(app.static_folder)
+    app.extensions['static_manifest'] = manifest
+    app.session_interface = StaticSessionInterface()
+
+    @app.url_defaults
+    def fingerprint_static_urls(endpoint, values):
+        if endpoint == 'static' and 'v' not in values:
+            fingerprint = manifest.get(values.get('filename'))
+            if fingerprint:
+                values['v'] = fingerprint
+
+    @app.after_request
+    def cache_and_compress(response):
+        if request.endpoint == 'static':
+            filename = (request.view_args or {}).get('filename')
+            if request.args.get('v') and request.args.get('v') == manifest.get(filename):
+                response.cache_control.no_cache = None
+                response.cache_control.public = True
+                response.cache_control.max_age = STATIC_MAX_AGE
+                response.cache_control.immutable = True
+            response.vary.add('Accept-Encoding')
+
+            variants = precompressed.get(filename) or {}
+            encoding = _preferred_encoding() if variants else None
+            if response.status_code == 200 and encoding in variants:
+                response.direct_passthrough = False
+                response.set_data(variants[encoding])
+                response.headers['Content-Encoding'] = encoding
+                etag, weak = response.get_etag()
+                if etag:
+                    response.set_etag(f"{etag}-{encoding}", weak)
+                    # Flask checked If-None-Match against the uncompressed file's ETag
+                    response.make_conditional(request)
+            return response
+
+        if (response.status_code < 200 or response.status_code in (204, 304)
+                or response.direct_passthrough or response.is_streamed
+                or 'Content-Encoding' in response.headers
+                or not _is_compressible(response.mimetype)):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = _preferred_encoding()
+        data = response.get_data()
+        if encoding is None or len(data) < min_size:
+            return response
+
+        response.set_data(_compress(data, encoding, level))
+        response.headers['Content-Encoding'] = encoding
+        return response
@@ -1,12 +1,15 @@
 from flask import render_template, request, redirect, url_for, flash, session
 from flask_login import LoginManager, login_user, logout_user, login_required
 from email_validator import validate_email, EmailNotValidError
+import logging
 import os
 from sendgrid import SendGridAPIClient
 from sendgrid.helpers.mail import Mail
 from app import app, db
 from models import User, PasswordResetToken
 
+logger = logging.getLogger(__name__)
+
 # Initialize Flask-Login
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -16,7 +19,11 @@ login_manager.login_message_category = 'info'
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(str(user_id))
+    user = User.query.get(str(user_id))
+    # Sessions of an account that is being deleted end right away
+    if user and user.deletion_requested_at:
+        return None
+    return user
 
 @app.route('/register', methods=['GET', 'POST'])
 def register():
@@ -74,7 +81,8 @@ def register():
             flash('Account created successfully! Please log in.', 'success')
             return redirect(url_for('login'))
             
-        except Exception as e:
+        except Exception:
+            logger.exception("Could not create account")
             db.session.rollback()
             flash('An error occurred while creating your account. Please try again.', 'error')
             return render_template('auth/register.html')
@@ -96,6 +104,10 @@ def login():
         user = User.query.filter_by(email=email).first()
         
         if user and user.check_password(password):
+            if user.deletion_requested_at:
+                flash('This account is being deleted.', 'error')
+                return render_template('auth/login.html')
+
             login_user(user, remember=remember_me)
             
             # Redirect to next page if specified, otherwise dashboard
@@ -127,7 +139,7 @@ def send_password_reset_email(user, token):
         # Check if SendGrid API key exists
         sendgrid_key = os.environ.get('SENDGRID_API_KEY')
         if not sendgrid_key:
-            print("WARNING: SENDGRID_API_KEY not found. Email will not be sent.")
+            logger.warning("SENDGRID_API_KEY not found. Email will not be sent.")
             return False
         
         # Create reset link
@@ -165,12 +177,14 @@ def send_password_reset_email(user, token):
             '''
         )
         
-        sg = SendGridAPIClient(api_key=sendgrid_key)
+        # SENDGRID_API_HOST points at a stand-in API, e.g. the load-test fake mail server
+        sg = SendGridAPIClient(api_key=sendgrid_key,
+                               host=os.environ.get('SENDGRID_API_HOST', 'https://api.sendgrid.com'))
         response = sg.send(message)
         return response.status_code in [200, 202]
         
-    except Exception as e:
-        print(f"Error sending email: {str(e)}")
+    except Exception:
+        logger.exception("Error sending password reset email")
         return False
 
 @app.route('/forgot-password', methods=['GET', 'POST'])
@@ -244,7 +258,8 @@ def reset_password(token):
             flash('Your password has been successfully reset. You can now log in with your new password.', 'success')
             return redirect(url_for('login'))
             
-        except Exception as e:
+        except Exception:
+            logger.exception("Could not reset password")
             db.session.rollback()
             flash('An error occurred while resetting your password. Please try again.', 'error')
     
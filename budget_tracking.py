@@ -0,0 +1,112 @@
+"""Running budget totals and threshold alerts, maintained as expenses are written.
+
+Every budget keeps the amount spent in its period in `budgets.spent`. Adding or
+deleting an expense adjusts the budgets it falls under with a single
+UPDATE ... RETURNING and compares the totals before and after against
+ALERT_THRESHOLDS, so nothing is re-summed. Crossing a threshold records a
+BudgetAlert; dropping back below it resolves the alert. The dashboard lists the
+open alerts straight from that table.
+
+Databases created before budgets had a `spent` column get it at startup (see
+schema.py), with every total at 0 until `flask --app main
+rebuild-budget-spending` recomputes them.
+"""
+import logging
+from collections import defaultdict
+from datetime import date, datetime
+
+import click
+from sqlalchemy import func, or_, update
+
+from app import app, db
+from archive import is_archived_year, month_bounds, year_bounds
+from models import Budget, BudgetAlert, Expense, ExpenseSummary
+from sharding import all_shards, use_shard
+
+# Percentages of a budget that raise an alert when spending reaches them
+ALERT_THRESHOLDS = (80, 100)
+
+def record_crossings(user_id, budget_id, amount, previous, spent):
+    """Open or resolve alerts for the thresholds between two totals; returns the new alerts"""
+    alerts = []
+    for threshold in ALERT_THRESHOLDS:
+        limit = amount * threshold / 100
+        if previous < limit <= spent:
+            alert = BudgetAlert(user_id=user_id, budget_id=budget_id, threshold=threshold, spent=spent)
+            db.session.add(alert)
+            alerts.append(alert)
+        elif spent < limit <= previous:
+            db.session.execute(update(BudgetAlert).where(
+                BudgetAlert.budget_id == budget_id,
+                BudgetAlert.threshold == threshold,
+                BudgetAlert.resolved_at.is_(None)
+            ).values(resolved_at=datetime.now()))
+    return alerts
+
+def apply_spending(user_id, category_id, expense_date, delta):
+    """Add `delta` to the budgets an expense date falls under; returns the alerts it opened"""
+    if not delta:
+        return []
+    budgets = db.session.execute(update(Budget).where(
+        Budget.user_id == user_id,
+        Budget.category_id == category_id,
+        Budget.year == expense_date.year,
+        or_(Budget.period == 'yearly', Budget.month == expense_date.month)
+    ).values(spent=Budget.spent + delta).returning(Budget.id, Budget.amount, Budget.spent)).all()
+
+    alerts = []
+    for budget_id, amount, spent in budgets:
+        alerts += record_crossings(user_id, budget_id, amount, spent - delta, spent)
+    return alerts
+
+def apply_bulk_spending(expense_rows):
+    """Apply rows inserted in bulk, one UPDATE per budget period instead of per row"""
+    deltas = defaultdict(int)
+    for row in expense_rows:
+        deltas[row['user_id'], row['category_id'], row['date'].year, row['date'].month] += row['amount']
+    for (user_id, category_id, year, month), delta in deltas.items():
+        apply_spending(user_id, category_id, date(year, month, 1), delta)
+
+def period_spending(budget):
+    """Sum the spending in a budget's category and period, including archived years"""
+    if budget.period == 'monthly':
+        period_start, period_end = month_bounds(budget.year, budget.month)
+    else:  # yearly
+        period_start, period_end = year_bounds(budget.year)
+    spent = db.session.query(func.sum(Expense.amount)).filter(
+        Expense.user_id == budget.user_id,
+        Expense.category_id == budget.category_id,
+        Expense.date >= period_start,
+        Expense.date < period_end
+    ).scalar() or 0
+
+    if is_archived_year(budget.year):
+        archived = db.session.query(func.sum(ExpenseSummary.total)).filter(
+            ExpenseSummary.user_id == budget.user_id,
+            ExpenseSummary.category_id == budget.category_id,
+            ExpenseSummary.year == budget.year
+        )
+        if budget.period == 'monthly':
+            archived = archived.filter(ExpenseSummary.month == budget.month)
+        spent += archived.scalar() or 0
+    return spent
+
+def start_budget(budget):
+    """Set the running total of a new budget; returns the alerts it starts with"""
+    budget.spent = period_spending(budget)
+    db.session.flush()
+    return record_crossings(budget.user_id, budget.id, budget.amount, 0, budget.spent)
+
+@app.cli.command('rebuild-budget-spending')
+def rebuild_budget_spending_command():
+    """Recompute the running total and alerts of every budget."""
+    for shard_key in all_shards():
+        with use_shard(shard_key):
+            rebuilt = 0
+            for budget in Budget.query.order_by(Budget.id).all():
+                previous, budget.spent = budget.spent, period_spending(budget)
+                record_crossings(budget.user_id, budget.id, budget.amount, previous, budget.spent)
+                rebuilt += 1
+            db.session.commit()
+        logging.info("Rebuilt spending of %d budgets on %s", rebuilt, shard_key)
+        click.echo(f"{shard_key}: rebuilt {rebuilt} budgets")
@@ -0,0 +1,43 @@
+"""Cached per-user category maps.
+
+Categories are tiny and rarely change, but almost every page needs them for
+ownership checks, dropdowns or names and colors. `user_categories` returns a
+user's categories as an {id: CachedCategory} map that is kept in a per-process
+LRU, keyed by the user's categories version (see templating.py), and memoized
+on `g` for the rest of the request. Only commits that touch the user's
+categories bump that version, so adding expenses keeps the map cached while a
+new category invalidates it in every worker.
+"""
+from collections import namedtuple
+
+from flask import g
+from sqlalchemy import select
+
+from app import db
+from models import Category
+from templating import FragmentCache, categories_version
+
+CachedCategory = namedtuple('CachedCategory', ['id', 'name', 'color'])
+
+_cache = FragmentCache(max_entries=4096)
+
+def user_categories(user_id):
+    """Get a user's categories as an {id: CachedCategory} map, in creation order"""
+    key = (user_id, categories_version(user_id))
+    memo = g.setdefault('user_categories', {})
+    if key not in memo:
+        categories = _cache.get(key)
+        if categories is None:
+            rows = db.session.execute(
+                select(Category.id, Category.name, Category.color).where(
+                    Category.user_id == user_id
+                ).order_by(Category.id)
+            )
+            categories = {row.id: CachedCategory(*row) for row in rows}
+            _cache.set(key, categories)
+        memo[key] = categories
+    return memo[key]
+
+def user_category(user_id, category_id):
+    """Get one of a user's categories, or None if it isn't theirs"""
+    return user_categories(user_id).get(category_id)
@@ -0,0 +1,59 @@
+"""Purge expired auth rows that would otherwise pile up forever.
+
+Run with `flask --app main purge-expired-tokens` (e.g. daily from cron). Used
+and expired password reset tokens are deleted, as are OAuth tokens of browser
+sessions older than the session lifetime, whose browser_session_key can no
+longer come back. Rows are deleted in batches of primary keys, each in its own
+short transaction, so the purge never holds long locks on the auth tables.
+"""
+import logging
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import delete, or_, select
+
+from app import app, db
+from models import OAuth, PasswordResetToken
+
+DEFAULT_BATCH_SIZE = 1000  # Rows deleted per transaction
+
+def delete_in_batches(model, condition, batch_size):
+    """Delete the rows matching `condition` batch by batch; returns the number deleted"""
+    deleted = 0
+    while True:
+        ids = db.session.scalars(select(model.id).where(condition).limit(batch_size)).all()
+        if not ids:
+            db.session.rollback()
+            return deleted
+        db.session.execute(delete(model).where(model.id.in_(ids)), execution_options={'synchronize_session': False})
+        db.session.commit()
+        deleted += len(ids)
+
+def purge_expired_tokens(now=None, oauth_max_age=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Delete used or expired reset tokens and stale OAuth rows; returns both counts"""
+    now = now or datetime.now()
+    oauth_max_age = oauth_max_age or app.permanent_session_lifetime
+
+    reset_tokens = delete_in_batches(
+        PasswordResetToken,
+        or_(PasswordResetToken.is_used.is_(True), PasswordResetToken.expires_at <= now),
+        batch_size
+    )
+    # OAuth rows are recreated whenever their token is refreshed, so created_at is the last use
+    oauth_tokens = delete_in_batches(
+        OAuth, OAuth.created_at < datetime.utcnow() - oauth_max_age, batch_size
+    )
+
+    logging.info("Purged %d password reset tokens and %d OAuth tokens", reset_tokens, oauth_tokens)
+    return reset_tokens, oauth_tokens
+
+@app.cli.command('purge-expired-tokens')
+@click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True,
+              help='Number of rows deleted per transaction.')
+@click.option('--oauth-max-age-days', type=int, default=None,
+              help='Delete OAuth tokens older than this (defaults to the session lifetime).')
+def purge_expired_tokens_command(batch_size, oauth_max_age_days):
+    """Delete used and expired password reset tokens and stale OAuth tokens."""
+    oauth_max_age = timedelta(days=oauth_max_age_days) if oauth_max_age_days else None
+    reset_tokens, oauth_tokens = purge_expired_tokens(oauth_max_age=oauth_max_age, batch_size=batch_size)
+    click.echo(f"Deleted {reset_tokens} password reset tokens and {oauth_tokens} OAuth tokens")
@@ -0,0 +1,175 @@
+"""Everything the dashboard shows, loaded in a single query.
+
+The widgets (monthly total, monthly budget, spending per category, recent
+expenses and open budget alerts) are selected as one UNION ALL over a CTE of
+the month's expenses. Every branch returns the same columns, tagged with a
+`kind`, and the rows are sorted into a DashboardData object for the template.
+"""
+from dataclasses import dataclass, field
+from datetime import date
+from decimal import Decimal
+
+import sqlalchemy as sa
+
+from app import db
+from archive import month_bounds
+from models import Budget, BudgetAlert, Category, Expense
+from money import Money
+
+# Columns every branch of the union selects, with the type used for NULL placeholders
+ROW_COLUMNS = {
+    'item_id': sa.Integer,
+    'name': sa.String,
+    'category': sa.String,
+    'color': sa.String,
+    'amount': Money(12),
+    'day': sa.Date,
+    'threshold': sa.Integer,
+    'limit_amount': Money(12),
+}
+
+RECENT_EXPENSES_LIMIT = 5
+
+@dataclass
+class CategorySpending:
+    name: str
+    color: str
+    total: Decimal
+
+@dataclass
+class RecentExpense:
+    id: int
+    date: date
+    description: str
+    category: str
+    color: str
+    amount: Decimal
+
+@dataclass
+class BudgetAlertSummary:
+    budget_id: int
+    name: str
+    threshold: int
+    spent: Decimal
+    amount: Decimal
+
+@dataclass
+class DashboardData:
+    year: int
+    month: int
+    monthly_expenses: Decimal = Decimal(0)
+    monthly_budget: Decimal = Decimal(0)
+    categories_spending: list = field(default_factory=list)
+    recent_expenses: list = field(default_factory=list)
+    budget_alerts: list = field(default_factory=list)
+
+    @property
+    def remaining(self):
+        """Get what is left of the monthly budget"""
+        return self.monthly_budget - self.monthly_expenses
+
+    @property
+    def budget_used(self):
+        """Get the share of the monthly budget spent, in percent"""
+        return (self.monthly_expenses / self.monthly_budget * 100) if self.monthly_budget > 0 else 0
+
+    def category_chart_data(self):
+        """Get [name, color, total] rows for the category chart"""
+        return [[item.name, item.color, item.total] for item in self.categories_spending]
+
+def _row(kind, **columns):
+    """Select list of one union branch, filling unused columns with typed NULLs"""
+    return [sa.literal(kind, sa.String).label('kind')] + [
+        (sa.type_coerce(columns[name], column_type) if name in columns else sa.cast(sa.null(), column_type)).label(name)
+        for name, column_type in ROW_COLUMNS.items()
+    ]
+
+def dashboard_query(user_id, year, month):
+    """Build the single statement returning every dashboard widget"""
+    month_start, month_end = month_bounds(year, month)
+    month_expenses = sa.select(
+        Expense.amount, Expense.category_id
+    ).where(
+        Expense.user_id == user_id,
+        Expense.date >= month_start,
+        Expense.date < month_end
+    ).cte('month_expenses')
+
+    total = sa.select(*_row('total', amount=sa.func.coalesce(sa.func.sum(month_expenses.c.amount), 0)))
+
+    budget = sa.select(*_row('budget', amount=sa.func.coalesce(sa.func.sum(Budget.amount), 0))).where(
+        Budget.user_id == user_id,
+        Budget.month == month,
+        Budget.year == year,
+        Budget.period == 'monthly'
+    )
+
+    categories = sa.select(*_row(
+        'category',
+        item_id=Category.id,
+        name=Category.name,
+        color=Category.color,
+        amount=sa.func.sum(month_expenses.c.amount)
+    )).join(month_expenses, month_expenses.c.category_id == Category.id).group_by(
+        Category.id, Category.name, Category.color
+    )
+
+    # Limited in a subquery, since members of a union can't be ordered on their own
+    latest = sa.select(
+        Expense.id, Expense.date, Expense.description, Expense.amount, Expense.category_id
+    ).where(Expense.user_id == user_id).order_by(
+        Expense.date.desc(), Expense.id.desc()
+    ).limit(RECENT_EXPENSES_LIMIT).subquery('latest')
+    recent = sa.select(*_row(
+        'recent',
+        item_id=latest.c.id,
+        name=latest.c.description,
+        category=Category.name,
+        color=Category.color,
+        amount=latest.c.amount,
+        day=latest.c.date
+    )).join(Category, Category.id == latest.c.category_id)
+
+    # Only the highest open threshold per budget of the current period
+    alerts = sa.select(*_row(
+        'alert',
+        item_id=Budget.id,
+        name=Budget.name,
+        amount=Budget.spent,
+        threshold=sa.func.max(BudgetAlert.threshold),
+        limit_amount=Budget.amount
+    )).join(BudgetAlert, BudgetAlert.budget_id == Budget.id).where(
+        BudgetAlert.user_id == user_id,
+        BudgetAlert.resolved_at.is_(None),
+        Budget.year == year,
+        sa.or_(Budget.period == 'yearly', Budget.month == month)
+    ).group_by(Budget.id, Budget.name, Budget.spent, Budget.amount)
+
+    # Selecting from the union lets the session see which tables it reads, to pick the user's shard
+    return sa.select(sa.union_all(total, budget, categories, recent, alerts).subquery('dashboard'))
+
+def load_dashboard(user_id, today=None):
+    """Load every dashboard widget for the current month in one round trip"""
+    today = today or date.today()
+    data = DashboardData(year=today.year, month=today.month)
+
+    for row in db.session.execute(dashboard_query(user_id, today.year, today.month)):
+        if row.kind == 'total':
+            data.monthly_expenses = row.amount
+        elif row.kind == 'budget':
+            data.monthly_budget = row.amount
+        elif row.kind == 'category':
+            data.categories_spending.append(CategorySpending(row.name, row.color, row.amount))
+        elif row.kind == 'recent':
+            data.recent_expenses.append(RecentExpense(
+                row.item_id, row.day, row.name, row.category, row.color, row.amount
+            ))
+        elif row.kind == 'alert':
+            data.budget_alerts.append(BudgetAlertSummary(
+                row.item_id, row.name, row.threshold, row.amount, row.limit_amount
+            ))
+
+    # Union rows come back in no particular order
+    data.recent_expenses.sort(key=lambda expense: (expense.date, expense.id), reverse=True)
+    data.budget_alerts.sort(key=lambda alert: alert.threshold, reverse=True)
+    return data
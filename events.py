@@ -0,0 +1,155 @@
+"""Per-user change events pushed to browsers with server-sent events.
+
+Routes publish small events (expense added/deleted, budget threshold crossed)
+after committing, and every open /events stream of that user receives them, so
+the dashboard and analytics pages apply deltas instead of re-fetching data.
+
+Fan-out goes through a broker chosen with EVENT_BROKER:
+
+- "local" (default): in-process queues, enough for a single worker.
+- "postgres": events are sent with NOTIFY and every worker runs one LISTEN
+  thread that hands them to its local subscribers.
+
+An idle stream only waits on its queue and holds no database connection, but
+it occupies a worker (thread) for as long as the tab stays open. Under the
+default sync gunicorn worker a single open stream would block every other
+request, so streams are off unless LIVE_UPDATES=1. Only set it when the server
+can hold idle connections, e.g. `gunicorn -k gevent` or gthread workers with
+enough threads; pages then connect to /events, otherwise they don't.
+"""
+import json
+import logging
+import os
+import queue
+import select
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import text
+
+KEEPALIVE_SECONDS = 15
+SUBSCRIBER_QUEUE_SIZE = 100
+
+logger = logging.getLogger(__name__)
+
+class LocalBroker:
+    """Fans events out to the subscribers of this process"""
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        subscription = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, user_id, subscription):
+        with self._lock:
+            subscriptions = self._subscribers.get(user_id)
+            if subscriptions:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscribers[user_id]
+
+    def publish(self, user_id, event):
+        self.deliver(user_id, event)
+
+    def deliver(self, user_id, event):
+        with self._lock:
+            subscriptions = list(self._subscribers.get(user_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.put_nowait(event)
+            except queue.Full:
+                # A stalled client loses events rather than blocking the publisher
+                pass
+
+class PostgresBroker(LocalBroker):
+    """Shares events between workers with PostgreSQL LISTEN/NOTIFY"""
+    CHANNEL = 'user_events'
+
+    def __init__(self, engine):
+        super().__init__()
+        self.engine = engine
+        self._listener = None
+
+    def subscribe(self, user_id):
+        # Start lazily so the thread is created after gunicorn forks the worker
+        if self._listener is None or not self._listener.is_alive():
+            self._listener = threading.Thread(target=self._listen, name='event-listener', daemon=True)
+            self._listener.start()
+        return super().subscribe(user_id)
+
+    def publish(self, user_id, event):
+        payload = json.dumps({'user_id': user_id, 'event': event})
+        with self.engine.begin() as conn:
+            conn.execute(text("SELECT pg_notify(:channel, :payload)"),
+                         {'channel': self.CHANNEL, 'payload': payload})
+
+    def _listen(self):
+        while True:
+            try:
+                raw = self.engine.raw_connection()
+                try:
+                    connection = raw.driver_connection
+                    connection.autocommit = True
+                    connection.cursor().execute(f"LISTEN {self.CHANNEL}")
+                    while True:
+                        if select.select([connection], [], [], KEEPALIVE_SECONDS) == ([], [], []):
+                            continue
+                        connection.poll()
+                        while connection.notifies:
+                            notification = json.loads(connection.notifies.pop(0).payload)
+                            self.deliver(notification['user_id'], notification['event'])
+                finally:
+                    raw.invalidate()
+            except Exception:
+                logger.exception("Event listener lost its connection, reconnecting")
+                time.sleep(1)
+
+def init_events(app, db):
+    """Create the event broker configured with EVENT_BROKER"""
+    backend = os.environ.get('EVENT_BROKER', 'local')
+    if backend == 'postgres':
+        with app.app_context():
+            broker = PostgresBroker(db.engine)
+    elif backend == 'local':
+        broker = LocalBroker()
+    else:
+        raise SystemExit(f"unknown EVENT_BROKER {backend!r}")
+    app.extensions['event_broker'] = broker
+
+    # Streams hold a worker each, so pages only open them when the server is set up for it
+    app.config['LIVE_UPDATES'] = os.environ.get('LIVE_UPDATES', '0') == '1'
+    app.jinja_env.globals['live_updates'] = app.config['LIVE_UPDATES']
+
+def publish_event(user_id, event_type, **data):
+    """Push an event to every open stream of a user"""
+    try:
+        current_app.extensions['event_broker'].publish(user_id, {'type': event_type, **data})
+    except Exception:
+        # Live updates are best effort; the change itself is already committed
+        logger.exception("Could not publish %s event", event_type)
+
+def stream_events(user_id):
+    """Generate the text/event-stream body for one client"""
+    broker = current_app.extensions['event_broker']
+
+    def generate():
+        subscription = broker.subscribe(user_id)
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    event = subscription.get(timeout=KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            broker.unsubscribe(user_id, subscription)
+
+    return generate()
@@ -0,0 +1,19 @@
+"""Load-test harness: the app under gunicorn, driven by concurrent virtual users.
+
+    python -m loadtest --users 50 --duration 60 --workers 4 --threads 8
+
+The harness seeds a database with users, categories, budgets and a year of
+expenses, boots `main:app` under gunicorn (gthread workers) and has every
+virtual user log in and then pick actions from a weighted mix: dashboard,
+expense list, add expense, the analytics APIs, CSV export, logout/login and the
+password reset flow. Email goes to a local fake SendGrid API (fake_mail.py)
+that the reset flow reads its links from, so nothing leaves the machine.
+
+The report lists throughput, latency percentiles and errors per action, and
+how close every worker's database pools came to running out of connections
+(sampled inside the workers, see gunicorn_conf.py).
+
+By default everything runs against a throwaway SQLite database, which
+serializes writes; pass --database-url (and name=url SHARD_DATABASE_URLS in the
+environment) to measure against PostgreSQL.
+"""
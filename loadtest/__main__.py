@@ -0,0 +1,211 @@
+"""Run a load test: seed, boot gunicorn with the fake mail server, drive traffic, report."""
+import argparse
+import glob
+import json
+import os
+import random
+import secrets
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+from loadtest.fake_mail import FakeSendGrid
+from loadtest.traffic import DEFAULT_MIX, Recorder, VirtualUser
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = 'loadtest-password'
+
+def parse_mix(spec):
+    """Parse "dashboard=30,export_csv=0" into weights on top of DEFAULT_MIX"""
+    mix = dict(DEFAULT_MIX)
+    for item in filter(None, spec.split(',')):
+        name, _, weight = item.partition('=')
+        if name.strip() not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown action {name!r}, choose from {', '.join(DEFAULT_MIX)}")
+        mix[name.strip()] = float(weight)
+    return {name: weight for name, weight in mix.items() if weight > 0}
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_until_ready(server, url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(f"gunicorn exited with status {server.returncode}")
+        try:
+            with urllib.request.urlopen(url, timeout=2):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise SystemExit(f"gunicorn didn't answer {url} within {timeout}s")
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an ascending list"""
+    index = max(0, -(-len(sorted_values) * pct // 100) - 1)
+    return sorted_values[int(index)]
+
+def summarize_requests(recorder, elapsed):
+    rows = {}
+    all_latencies = []
+    for name, latencies in sorted(recorder.latencies.items()):
+        all_latencies += latencies
+        rows[name] = _latency_row(sorted(latencies), recorder.errors[name], elapsed)
+    rows['TOTAL'] = _latency_row(sorted(all_latencies), sum(recorder.errors.values()), elapsed)
+    return rows
+
+def _latency_row(latencies, errors, elapsed):
+    if not latencies:
+        return {'requests': 0, 'errors': errors}
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'error_rate': errors / len(latencies),
+        'rps': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'max_ms': latencies[-1] * 1000,
+    }
+
+def summarize_pools(stats_dir):
+    """Combine the per-worker pool samples into one row per shard"""
+    pools = {}
+    for path in glob.glob(os.path.join(stats_dir, 'pool-*.json')):
+        with open(path) as f:
+            for shard_key, stats in json.load(f).items():
+                pool = pools.setdefault(shard_key, {
+                    'workers': 0, 'capacity': stats['capacity'], 'samples': 0, 'in_use_total': 0,
+                    'peak': 0, 'overflow_samples': 0, 'saturated_samples': 0,
+                })
+                pool['workers'] += 1
+                pool['peak'] = max(pool['peak'], stats['peak'])
+                for key in ('samples', 'in_use_total', 'overflow_samples', 'saturated_samples'):
+                    pool[key] += stats[key]
+
+    return {shard_key: {
+        'workers': pool['workers'],
+        'capacity_per_worker': pool['capacity'],
+        'peak_in_use': pool['peak'],
+        'mean_in_use': pool['in_use_total'] / pool['samples'] if pool['samples'] else 0,
+        'overflow_share': pool['overflow_samples'] / pool['samples'] if pool['samples'] else 0,
+        'saturated_share': pool['saturated_samples'] / pool['samples'] if pool['samples'] else 0,
+    } for shard_key, pool in pools.items()}
+
+def print_report(report):
+    settings = report['settings']
+    print(f"\n{settings['users']} users, {settings['workers']} workers x {settings['threads']} threads, "
+          f"{report['elapsed_s']:.1f}s, {report['emails_sent']} emails sent\n")
+    print(f"{'request':<20}{'count':>8}{'err %':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for name, row in report['requests'].items():
+        if not row['requests']:
+            continue
+        print(f"{name:<20}{row['requests']:>8}{row['error_rate'] * 100:>8.2f}{row['rps']:>9.1f}"
+              f"{row['p50_ms']:>9.1f}{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}{row['max_ms']:>9.1f}")
+
+    if report['error_examples']:
+        print("\nFirst error per request:")
+        for name, error in report['error_examples'].items():
+            print(f"  {name}: {error}")
+
+    print(f"\n{'db pool':<20}{'workers':>8}{'size':>6}{'peak':>6}{'mean':>7}{'overflow %':>12}{'saturated %':>13}")
+    for shard_key, pool in report['pools'].items():
+        print(f"{shard_key:<20}{pool['workers']:>8}{pool['capacity_per_worker']:>6}{pool['peak_in_use']:>6}"
+              f"{pool['mean_in_use']:>7.2f}{pool['overflow_share'] * 100:>12.1f}{pool['saturated_share'] * 100:>13.1f}")
+    print(f"\ngunicorn log: {report['server_log']}")
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m loadtest', description=__doc__)
+    parser.add_argument('--users', type=int, default=20, help='Concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds of traffic')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=8, help='Threads per gunicorn worker')
+    parser.add_argument('--mix', type=parse_mix, default=dict(DEFAULT_MIX),
+                        help=f"Action weights, e.g. dashboard=50,password_reset=0 (defaults: "
+                             f"{', '.join(f'{k}={v}' for k, v in DEFAULT_MIX.items())})")
+    parser.add_argument('--think-time', type=float, default=0.0, help='Mean pause between actions in seconds')
+    parser.add_argument('--expenses', type=int, default=300, help='Seeded expenses per user')
+    parser.add_argument('--mail-latency-ms', type=float, default=50, help='Response time of the fake mail API')
+    parser.add_argument('--database-url', help='Database to test against (default: a fresh SQLite file)')
+    parser.add_argument('--json', dest='json_path', help='Also write the report to this file')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='loadtest-')
+    stats_dir = os.path.join(work_dir, 'stats')
+    os.mkdir(stats_dir)
+    mailbox = FakeSendGrid(latency=args.mail_latency_ms / 1000).start()
+    port = free_port()
+
+    env = dict(os.environ)
+    env.update({
+        'DATABASE_URL': args.database_url or f"sqlite:///{os.path.join(work_dir, 'loadtest.db')}",
+        'SESSION_SECRET': env.get('SESSION_SECRET') or secrets.token_hex(16),
+        'SENDGRID_API_KEY': 'loadtest',
+        'SENDGRID_API_HOST': mailbox.host,
+        'LOADTEST_STATS_DIR': stats_dir,
+    })
+    env.setdefault('LOG_LEVEL', 'WARNING')
+
+    users_path = os.path.join(work_dir, 'users.json')
+    print(f"Seeding {args.users} users with {args.expenses} expenses each...")
+    subprocess.run([sys.executable, '-m', 'loadtest.seed', '--users', str(args.users),
+                    '--email-prefix', f"loadtest-{secrets.token_hex(4)}", '--password', PASSWORD,
+                    '--expenses', str(args.expenses), '--output', users_path],
+                   cwd=ROOT, env=env, check=True)
+    with open(users_path) as f:
+        users = json.load(f)
+
+    server_log_path = os.path.join(work_dir, 'gunicorn.log')
+    with open(server_log_path, 'wb') as server_log:
+        server = subprocess.Popen([
+            sys.executable, '-m', 'gunicorn', 'main:app',
+            '--config', os.path.join(ROOT, 'loadtest', 'gunicorn_conf.py'),
+            '--bind', f"127.0.0.1:{port}",
+            '--workers', str(args.workers),
+            '--threads', str(args.threads),
+        ], cwd=ROOT, env=env, stdout=server_log, stderr=subprocess.STDOUT)
+    try:
+        wait_until_ready(server, f"http://127.0.0.1:{port}/login")
+        print(f"Running {args.users} users for {args.duration:.0f}s against 127.0.0.1:{port}...")
+
+        recorder = Recorder()
+        started = time.monotonic()
+        deadline = started + args.duration
+        threads = [threading.Thread(target=VirtualUser(
+            ('127.0.0.1', port), user['email'], PASSWORD, user['category_ids'],
+            recorder, mailbox, random.Random(n)
+        ).run, args=(args.mix, deadline, args.think_time)) for n, user in enumerate(users)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+    finally:
+        # A graceful stop runs worker_exit, which writes the final pool samples
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=60)
+        mailbox.shutdown()
+
+    report = {
+        'settings': {key: value for key, value in vars(args).items() if key != 'json_path'},
+        'elapsed_s': elapsed,
+        'emails_sent': mailbox.sent,
+        'requests': summarize_requests(recorder, elapsed),
+        'error_examples': dict(recorder.error_examples),
+        'pools': summarize_pools(stats_dir),
+        'server_log': server_log_path,
+    }
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""A local stand-in for the SendGrid v3 mail API.
+
+The app is pointed at it with SENDGRID_API_HOST. Messages are kept in memory
+per recipient so virtual users can pick up the links they were sent.
+"""
+import json
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RESET_LINK = re.compile(r'href="([^"]*/reset-password/[^"]+)"')
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path != '/v3/mail/send':
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.server.deliver(json.loads(body))
+        self.send_response(202)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+class FakeSendGrid(ThreadingHTTPServer):
+    """Accepts mail/send calls, answers 202 after `latency` seconds and keeps the messages"""
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.0):
+        super().__init__(address, _Handler)
+        self.latency = latency
+        self.sent = 0
+        self._messages = defaultdict(deque)
+        self._condition = threading.Condition()
+
+    @property
+    def host(self):
+        """Base URL to use as SENDGRID_API_HOST"""
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def deliver(self, payload):
+        html = ''.join(content['value'] for content in payload.get('content', []))
+        with self._condition:
+            for personalization in payload.get('personalizations', []):
+                for recipient in personalization.get('to', []):
+                    self._messages[recipient['email']].append(html)
+                    self.sent += 1
+            self._condition.notify_all()
+
+    def pop_message(self, email, timeout=10):
+        """Wait for the oldest unread message to `email`; None if none arrives in time"""
+        with self._condition:
+            if self._condition.wait_for(lambda: self._messages[email], timeout):
+                return self._messages[email].popleft()
+        return None
+
+    def pop_reset_link(self, email, timeout=10):
+        """Wait for a password reset email and return the link in it"""
+        message = self.pop_message(email, timeout)
+        match = RESET_LINK.search(message or '')
+        return match.group(1) if match else None
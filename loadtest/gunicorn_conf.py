@@ -0,0 +1,77 @@
+"""gunicorn settings for load tests: every worker samples its database pools.
+
+A thread in each worker reads how many connections every engine has checked out
+every LOADTEST_POOL_SAMPLE_MS and keeps running totals in
+LOADTEST_STATS_DIR/pool-<pid>.json, which the harness aggregates afterwards.
+"""
+import json
+import os
+import threading
+import time
+
+worker_class = 'gthread'
+
+_stats_dir = os.environ['LOADTEST_STATS_DIR']
+_sample_interval = float(os.environ.get('LOADTEST_POOL_SAMPLE_MS', 20)) / 1000
+_write_interval = 1.0
+
+class _PoolSampler:
+    """Samples checked-out connections of a worker's engines"""
+
+    def __init__(self, engines, path):
+        self.path = path
+        self.pools = {}
+        self.stats = {}
+        for shard_key, engine in engines.items():
+            pool = engine.pool
+            if not hasattr(pool, 'checkedout'):
+                continue  # SingletonThreadPool, NullPool etc. have no fixed capacity
+            self.pools[shard_key] = pool
+            self.stats[shard_key] = {
+                # QueuePool has no public accessor for max_overflow
+                'capacity': pool.size() + max(pool._max_overflow, 0),
+                'pool_size': pool.size(),
+                'samples': 0,
+                'in_use_total': 0,
+                'peak': 0,
+                'overflow_samples': 0,
+                'saturated_samples': 0,
+            }
+
+    def sample(self):
+        for shard_key, pool in self.pools.items():
+            stats = self.stats[shard_key]
+            in_use = pool.checkedout()
+            stats['samples'] += 1
+            stats['in_use_total'] += in_use
+            stats['peak'] = max(stats['peak'], in_use)
+            stats['overflow_samples'] += in_use > stats['pool_size']
+            stats['saturated_samples'] += in_use >= stats['capacity']
+
+    def write(self):
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(self.stats, f)
+        os.replace(self.path + '.tmp', self.path)
+
+    def run(self):
+        next_write = time.monotonic() + _write_interval
+        while True:
+            self.sample()
+            if time.monotonic() >= next_write:
+                self.write()
+                next_write += _write_interval
+            time.sleep(_sample_interval)
+
+def post_worker_init(worker):
+    from app import app
+    from sharding import all_shards, shard_engine
+
+    with app.app_context():
+        engines = {shard_key: shard_engine(shard_key) for shard_key in all_shards()}
+    worker.pool_sampler = _PoolSampler(engines, os.path.join(_stats_dir, f'pool-{os.getpid()}.json'))
+    threading.Thread(target=worker.pool_sampler.run, daemon=True).start()
+
+def worker_exit(server, worker):
+    sampler = getattr(worker, 'pool_sampler', None)
+    if sampler is not None:
+        sampler.write()
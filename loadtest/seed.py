@@ -0,0 +1,83 @@
+"""Create load-test users with categories, budgets and a year of expenses.
+
+The harness runs this before gunicorn starts, with the same environment:
+
+    python -m loadtest.seed --users 50 --email-prefix loadtest-1a2b --password secret123 --output users.json
+
+The output file lists every user's email and category ids.
+
+Users are created directly rather than through /register, which validates
+email deliverability over DNS.
+"""
+import argparse
+import json
+import random
+from datetime import date, timedelta
+from decimal import Decimal
+
+from sqlalchemy import insert
+
+from main import app
+from app import db
+from models import Budget, Category, Expense, User
+from routes import DEFAULT_CATEGORIES
+from budget_tracking import apply_bulk_spending, start_budget
+from sharding import DEFAULT_SHARD, shard_for_user, use_shard
+from templating import touch_user_data
+
+def seed_user(email, password, expense_count, rng, today):
+    """Create a user with the default categories, three budgets and `expense_count` expenses; returns the category ids"""
+    user = User(email=email, first_name='Load', last_name='Test', auth_type='local')
+    user.set_password(password)
+    db.session.add(user)
+    db.session.commit()
+
+    shard_key = shard_for_user(user.id) if 'shard_router' in app.extensions else DEFAULT_SHARD
+    with use_shard(shard_key):
+        categories = [Category(name=name, color=color, user_id=user.id) for name, color in DEFAULT_CATEGORIES]
+        db.session.add_all(categories)
+        db.session.flush()
+        category_ids = [category.id for category in categories]
+
+        for category in categories[:3]:
+            budget = Budget(name=f"{category.name} budget", amount=Decimal(rng.randrange(200, 1000)),
+                            period='monthly', year=today.year, month=today.month,
+                            user_id=user.id, category_id=category.id)
+            db.session.add(budget)
+            start_budget(budget)
+
+        expense_rows = [{
+            'amount': Decimal(rng.randrange(100, 20000)).scaleb(-2),
+            'description': f"Seeded expense {n}",
+            'date': today - timedelta(days=rng.randrange(365)),
+            'user_id': user.id,
+            'category_id': rng.choice(category_ids),
+        } for n in range(expense_count)]
+        if expense_rows:
+            db.session.execute(insert(Expense), expense_rows)
+            apply_bulk_spending(expense_rows)
+            touch_user_data(db.session, [user.id])
+        db.session.commit()
+    return category_ids
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, required=True)
+    parser.add_argument('--email-prefix', required=True)
+    parser.add_argument('--password', required=True)
+    parser.add_argument('--expenses', type=int, default=300, help='Expenses per user')
+    parser.add_argument('--output', required=True, help='JSON file to write the users to')
+    args = parser.parse_args()
+
+    rng = random.Random(args.email_prefix)
+    users = []
+    with app.test_request_context():
+        for n in range(args.users):
+            email = f"{args.email_prefix}-{n}@example.com"
+            category_ids = seed_user(email, args.password, args.expenses, rng, date.today())
+            users.append({'email': email, 'category_ids': category_ids})
+    with open(args.output, 'w') as f:
+        json.dump(users, f)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""Virtual users that drive a mix of requests against the app and time every one."""
+import http.client
+import threading
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urlsplit
+
+# Relative weights of the actions a virtual user picks from
+DEFAULT_MIX = {
+    'dashboard': 30,
+    'expenses': 10,
+    'add_expense': 20,
+    'monthly_spending': 10,
+    'category_breakdown': 10,
+    'export_csv': 8,
+    'login': 10,
+    'password_reset': 2,
+}
+
+class Recorder:
+    """Collects the latency and outcome of every request, grouped by name"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.error_examples = {}
+
+    def record(self, name, seconds, error=None):
+        with self._lock:
+            self.latencies[name].append(seconds)
+            if error:
+                self.errors[name] += 1
+                self.error_examples.setdefault(name, error)
+
+class VirtualUser:
+    """One logged-in user with its own keep-alive connection and cookies"""
+
+    def __init__(self, address, email, password, category_ids, recorder, mailbox, rng):
+        self.email = email
+        self.password = password
+        self.category_ids = category_ids
+        self.recorder = recorder
+        self.mailbox = mailbox
+        self.rng = rng
+        self.conn = http.client.HTTPConnection(*address, timeout=60)
+        self.cookies = {}
+
+    def _send(self, method, path, form):
+        body = urlencode(form) if form is not None else None
+        headers = {'Cookie': '; '.join(f"{name}={value}" for name, value in self.cookies.items())}
+        if body is not None:
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        try:
+            self.conn.request(method, path, body=body, headers=headers)
+            response = self.conn.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            # The server closed an idle keep-alive connection before reading the request
+            self.conn.close()
+            self.conn.request(method, path, body=body, headers=headers)
+            response = self.conn.getresponse()
+        data = response.read()
+
+        for header in response.headers.get_all('Set-Cookie') or []:
+            for morsel in SimpleCookie(header).values():
+                if morsel['max-age'] == '0' or not morsel.value:
+                    self.cookies.pop(morsel.key, None)
+                else:
+                    self.cookies[morsel.key] = morsel.value
+        return response.status, response.getheader('Location', ''), data
+
+    def request(self, name, method, path, form=None, redirect_to=None):
+        """Send a timed request; it fails on errors, login redirects or an unexpected response"""
+        started = time.perf_counter()
+        try:
+            status, location, data = self._send(method, path, form)
+        except (OSError, http.client.HTTPException) as exc:
+            self.conn.close()
+            self.recorder.record(name, time.perf_counter() - started, f"{type(exc).__name__}: {exc}")
+            return None, b''
+
+        error = None
+        if status >= 400:
+            error = f"HTTP {status}"
+        elif redirect_to is not None and (status != 302 or urlsplit(location).path != redirect_to):
+            error = f"HTTP {status} {location or ''}".rstrip()
+        elif redirect_to is None and urlsplit(location).path == '/login':
+            error = "Redirected to login"
+        self.recorder.record(name, time.perf_counter() - started, error)
+        return status, data
+
+    def login(self):
+        self.request('login', 'POST', '/login',
+                     {'email': self.email, 'password': self.password}, redirect_to='/dashboard')
+
+    # Actions, picked by name from the mix
+
+    def dashboard(self):
+        self.request('dashboard', 'GET', '/dashboard')
+
+    def expenses(self):
+        self.request('expenses', 'GET', f"/expenses?page={self.rng.randint(1, 3)}")
+
+    def add_expense(self):
+        self.request('add_expense', 'POST', '/expenses/add', {
+            'amount': f"{self.rng.randrange(100, 20000) / 100:.2f}",
+            'description': 'Load test expense',
+            'date': (date.today() - timedelta(days=self.rng.randrange(60))).isoformat(),
+            'category_id': self.rng.choice(self.category_ids),
+        }, redirect_to='/expenses')
+
+    def monthly_spending(self):
+        self.request('monthly_spending', 'GET', f"/api/analytics/monthly-spending?year={date.today().year}")
+
+    def category_breakdown(self):
+        today = date.today()
+        self.request('category_breakdown', 'GET',
+                     f"/api/analytics/category-breakdown?month={today.month}&year={today.year}")
+
+    def export_csv(self):
+        self.request('export_csv', 'GET', '/export-csv')
+
+    def login_again(self):
+        self.request('logout', 'GET', '/logout', redirect_to='/')
+        self.login()
+
+    def password_reset(self):
+        """Request a reset email, open its link and set the same password again"""
+        self.request('forgot_password', 'POST', '/forgot-password', {'email': self.email}, redirect_to='/login')
+        link = self.mailbox.pop_reset_link(self.email)
+        if link is None:
+            self.recorder.record('reset_password', 0.0, "No reset email arrived")
+            return
+        path = urlsplit(link).path
+        self.request('reset_password', 'GET', path)
+        self.request('reset_password', 'POST', path,
+                     {'password': self.password, 'confirm_password': self.password}, redirect_to='/login')
+
+    def run(self, mix, deadline, think_time):
+        """Perform weighted random actions until `deadline` (time.monotonic)"""
+        self.login()
+        names, weights = zip(*mix.items())
+        actions = {name: getattr(self, 'login_again' if name == 'login' else name) for name in names}
+        while time.monotonic() < deadline:
+            actions[self.rng.choices(names, weights)[0]]()
+            if think_time:
+                time.sleep(self.rng.uniform(0, 2 * think_time))
+        self.conn.close()
@@ -0,0 +1,146 @@
+"""Logging configuration: structured output, a background writer and request sampling.
+
+Configured from the environment:
+
+- LOG_LEVEL: root level (default INFO)
+- LOG_LEVELS: per-logger overrides, e.g. "sqlalchemy.engine=INFO,events=DEBUG"
+- LOG_FORMAT: "json" (default, one object per line) or "text"
+- LOG_REQUEST_SAMPLE_RATE: share of ordinary requests logged (default 0.1)
+- LOG_SLOW_REQUEST_MS: requests at least this slow are always logged (default 1000)
+
+Records are put on a queue by a QueueHandler and written by a listener thread,
+so request threads never block on log I/O. Requests that fail with a server
+error or are slow are always logged; the rest are sampled.
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+from datetime import datetime, timezone
+
+from flask import g, request
+from flask_login import current_user
+
+ACCESS_LOGGER = 'access'
+
+# Attributes every LogRecord has; anything else was passed with `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as single-line JSON objects, including `extra` fields"""
+
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        data.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES)
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data['exception'] = record.exc_text
+        return json.dumps(data, default=str)
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Queues records unformatted, so the listener's formatter still sees exc_info"""
+
+    def prepare(self, record):
+        # The stock prepare() formats the record here and drops exc_info. Only
+        # merge the arguments, which may change before the listener gets to them.
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        return record
+
+def parse_levels(spec):
+    """Parse "name=LEVEL,name=LEVEL" into a {logger name: level} mapping"""
+    levels = {}
+    for item in spec.split(','):
+        if '=' in item:
+            name, level = item.split('=', 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+class _Listener:
+    """Owns the queue listener, restarting it in forked workers"""
+
+    def __init__(self, queue_handler, handlers):
+        self.queue_handler = queue_handler
+        self.handlers = handlers
+        self.listener = None
+        self.start()
+
+    def start(self):
+        self.queue_handler.queue = queue.SimpleQueue()
+        self.listener = logging.handlers.QueueListener(
+            self.queue_handler.queue, *self.handlers, respect_handler_level=True
+        )
+        self.listener.start()
+
+    def stop(self):
+        self.listener.stop()
+
+def configure_logging():
+    """Route every log record through a queue to a formatted stderr handler"""
+    stream_handler = logging.StreamHandler(sys.stderr)
+    if os.environ.get('LOG_FORMAT', 'json') == 'text':
+        stream_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    else:
+        stream_handler.setFormatter(JsonFormatter())
+
+    queue_handler = _QueueHandler(queue.SimpleQueue())
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
+    for name, level in parse_levels(os.environ.get('LOG_LEVELS', '')).items():
+        logging.getLogger(name).setLevel(level)
+
+    listener = _Listener(queue_handler, [stream_handler])
+    # The listener thread doesn't survive a fork (gunicorn --preload), so start a new one
+    os.register_at_fork(after_in_child=listener.start)
+    # Flush whatever is still queued on shutdown
+    atexit.register(listener.stop)
+    return listener
+
+def init_logging(app):
+    """Configure logging and log a sample of requests, always including slow and failed ones"""
+    configure_logging()
+    sample_rate = float(os.environ.get('LOG_REQUEST_SAMPLE_RATE', 0.1))
+    slow_ms = float(os.environ.get('LOG_SLOW_REQUEST_MS', 1000))
+    access_logger = logging.getLogger(ACCESS_LOGGER)
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def log_request(response):
+        started = g.pop('request_started', None)
+        if started is None:
+            return response
+        duration_ms = (time.perf_counter() - started) * 1000
+        failed = response.status_code >= 500
+        slow = duration_ms >= slow_ms
+        if not (failed or slow or random.random() < sample_rate):
+            return response
+
+        level = logging.ERROR if failed else logging.WARNING if slow else logging.INFO
+        access_logger.log(
+            level, "%s %s %s %.1fms", request.method, request.path, response.status_code, duration_ms,
+            extra={
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'duration_ms': round(duration_ms, 1),
+                'user_id': current_user.get_id(),
+                'sampled': not (failed or slow),
+            }
+        )
+        return response
@@ -1,8 +1,10 @@
 from datetime import datetime, timedelta
+import calendar
 from app import db
+from money import Money
 from flask_dance.consumer.storage.sqla import OAuthConsumerMixin
 from flask_login import UserMixin
-from sqlalchemy import UniqueConstraint
+from sqlalchemy import UniqueConstraint, update
 from werkzeug.security import generate_password_hash, check_password_hash
 import uuid
 import secrets
@@ -17,6 +19,7 @@ class User(UserMixin, db.Model):
     profile_image_url = db.Column(db.String, nullable=True)
     auth_type = db.Column(db.String(20), default='local')  # 'local' or 'oauth'
     is_verified = db.Column(db.Boolean, default=True)  # For future email verification
+    deletion_requested_at = db.Column(db.DateTime, nullable=True)  # Set until the account's data is deleted (see account.py)
     created_at = db.Column(db.DateTime, default=datetime.now)
     updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
     
@@ -41,34 +44,48 @@ class User(UserMixin, db.Model):
             return self.email.split('@')[0]  # Use email username as fallback
 
     # Relationships
-    expenses = db.relationship('Expense', backref='user', lazy=True, cascade='all, delete-orphan')
-    budgets = db.relationship('Budget', backref='user', lazy=True, cascade='all, delete-orphan')
-    categories = db.relationship('Category', backref='user', lazy=True, cascade='all, delete-orphan')
+    expenses = db.relationship('Expense', backref='user', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
+    budgets = db.relationship('Budget', backref='user', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
+    categories = db.relationship('Category', backref='user', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
+    recurring_expenses = db.relationship('RecurringExpense', backref='user', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
+    archived_expenses = db.relationship('ExpenseArchive', backref='user', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
+    expense_summaries = db.relationship('ExpenseSummary', backref='user', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
+    budget_alerts = db.relationship('BudgetAlert', backref='user', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
 
 # (IMPORTANT) This table is mandatory for Replit Auth, don't drop it.
 class OAuth(OAuthConsumerMixin, db.Model):
-    user_id = db.Column(db.String, db.ForeignKey(User.id))
+    user_id = db.Column(db.String, db.ForeignKey(User.id, ondelete='CASCADE'))
     browser_session_key = db.Column(db.String, nullable=False)
     user = db.relationship(User)
 
-    __table_args__ = (UniqueConstraint(
-        'user_id',
-        'browser_session_key',
-        'provider',
-        name='uq_user_browser_session_key_provider',
-    ),)
+    __table_args__ = (
+        UniqueConstraint(
+            'user_id',
+            'browser_session_key',
+            'provider',
+            name='uq_user_browser_session_key_provider',
+        ),
+        # Stale rows of ended browser sessions are purged by age
+        db.Index('ix_flask_dance_oauth_created_at', 'created_at'),
+    )
 
 class PasswordResetToken(db.Model):
     __tablename__ = 'password_reset_tokens'
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.String, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     token = db.Column(db.String(100), unique=True, nullable=False)
     expires_at = db.Column(db.DateTime, nullable=False)
     is_used = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.now)
+
+    __table_args__ = (
+        # verify_token uses the unique token index; this covers the invalidation in create_token
+        db.Index('ix_password_reset_tokens_user_id_is_used', 'user_id', 'is_used'),
+        db.Index('ix_password_reset_tokens_expires_at', 'expires_at'),
+    )
     
     # Relationship
-    user = db.relationship('User', backref='password_reset_tokens')
+    user = db.relationship('User', backref=db.backref('password_reset_tokens', cascade='all, delete-orphan', passive_deletes=True))
     
     def __init__(self, user_id):
         self.user_id = user_id
@@ -78,10 +95,10 @@ class PasswordResetToken(db.Model):
     @classmethod
     def create_token(cls, user_id):
         """Create a new password reset token"""
-        # Invalidate any existing tokens for this user
-        existing_tokens = cls.query.filter_by(user_id=user_id, is_used=False).all()
-        for token in existing_tokens:
-            token.is_used = True
+        # Invalidate any existing tokens for this user in a single UPDATE
+        db.session.execute(
+            update(cls).where(cls.user_id == user_id, cls.is_used.is_(False)).values(is_used=True)
+        )
         
         # Create new token
         new_token = cls(user_id)
@@ -92,10 +109,11 @@ class PasswordResetToken(db.Model):
     @classmethod
     def verify_token(cls, token_string):
         """Verify if a token is valid and not expired"""
-        token = cls.query.filter_by(token=token_string, is_used=False).first()
-        if token and token.expires_at > datetime.now():
-            return token
-        return None
+        return cls.query.filter(
+            cls.token == token_string,
+            cls.is_used.is_(False),
+            cls.expires_at > datetime.now()
+        ).first()
     
     def use_token(self):
         """Mark the token as used"""
@@ -107,7 +125,7 @@ class Category(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     color = db.Column(db.String(7), default='#007bff')  # Hex color code
-    user_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.String, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.now)
 
     # Relationships
@@ -117,23 +135,141 @@ class Category(db.Model):
 class Expense(db.Model):
     __tablename__ = 'expenses'
     id = db.Column(db.Integer, primary_key=True)
-    amount = db.Column(db.Numeric(10, 2), nullable=False)
+    amount = db.Column(Money(10), nullable=False)
     description = db.Column(db.String(255), nullable=False)
     date = db.Column(db.Date, nullable=False, default=datetime.now().date)
-    user_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.String, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     category_id = db.Column(db.Integer, db.ForeignKey('categories.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.now)
     updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
 
+    __table_args__ = (db.Index('ix_expenses_user_id_date', 'user_id', 'date'),)
+
 class Budget(db.Model):
     __tablename__ = 'budgets'
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
-    amount = db.Column(db.Numeric(10, 2), nullable=False)
+    amount = db.Column(Money(10), nullable=False)
     period = db.Column(db.String(20), nullable=False, default='monthly')  # monthly, yearly
     month = db.Column(db.Integer, nullable=True)  # 1-12 for monthly budgets
     year = db.Column(db.Integer, nullable=False)
-    user_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False)
+    spent = db.Column(Money(12), nullable=False, default=0)  # Running total, see budget_tracking.py
+    user_id = db.Column(db.String, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    category_id = db.Column(db.Integer, db.ForeignKey('categories.id'), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+    # Relationships
+    alerts = db.relationship('BudgetAlert', backref='budget', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
+
+    __table_args__ = (db.Index('ix_budgets_user_id_category_id_year', 'user_id', 'category_id', 'year'),)
+
+    @property
+    def percentage(self):
+        """Get how much of the budget has been spent, in percent"""
+        return (self.spent / self.amount * 100) if self.amount > 0 else 0
+
+# A budget crossing one of its alert thresholds; resolved when spending drops back below
+class BudgetAlert(db.Model):
+    __tablename__ = 'budget_alerts'
+    id = db.Column(db.Integer, primary_key=True)
+    threshold = db.Column(db.Integer, nullable=False)  # Percentage of the budget, e.g. 80 or 100
+    spent = db.Column(Money(12), nullable=False)  # Budget spending when the threshold was crossed
+    user_id = db.Column(db.String, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    budget_id = db.Column(db.Integer, db.ForeignKey('budgets.id', ondelete='CASCADE'), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    resolved_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (db.Index('ix_budget_alerts_user_id_resolved_at', 'user_id', 'resolved_at'),)
+
+class RecurringExpense(db.Model):
+    __tablename__ = 'recurring_expenses'
+    id = db.Column(db.Integer, primary_key=True)
+    amount = db.Column(Money(10), nullable=False)
+    description = db.Column(db.String(255), nullable=False)
+    rule = db.Column(db.String(20), nullable=False, default='monthly')  # daily, weekly, monthly, yearly
+    anchor_day = db.Column(db.Integer, nullable=False)  # Day of month the rule was started on
+    next_run = db.Column(db.Date, nullable=False, index=True)
+    end_date = db.Column(db.Date, nullable=True)
+    is_active = db.Column(db.Boolean, nullable=False, default=True)
+    user_id = db.Column(db.String, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     category_id = db.Column(db.Integer, db.ForeignKey('categories.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.now)
     updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+    # Relationships
+    category = db.relationship('Category')
+
+    RULES = ('daily', 'weekly', 'monthly', 'yearly')
+
+    def following_run(self, current):
+        """Get the occurrence date that comes after `current` for this rule"""
+        if self.rule == 'daily':
+            return current + timedelta(days=1)
+        if self.rule == 'weekly':
+            return current + timedelta(weeks=1)
+
+        months = 1 if self.rule == 'monthly' else 12
+        month_index = current.year * 12 + current.month - 1 + months
+        year, month = divmod(month_index, 12)
+        month += 1
+        # Clamp to the end of short months, but go back to the anchor day afterwards
+        day = min(self.anchor_day, calendar.monthrange(year, month)[1])
+        return current.replace(year=year, month=month, day=day)
+
+# Closed years whose raw expenses have been moved to expenses_archive
+class ArchivedYear(db.Model):
+    __tablename__ = 'archived_years'
+    year = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    archived_at = db.Column(db.DateTime, default=datetime.now)
+
+class ExpenseArchive(db.Model):
+    __tablename__ = 'expenses_archive'
+    id = db.Column(db.Integer, primary_key=True)
+    amount = db.Column(Money(10), nullable=False)
+    description = db.Column(db.String(255), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    user_id = db.Column(db.String, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    category_id = db.Column(db.Integer, db.ForeignKey('categories.id'), nullable=False)
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.now)
+
+    # Relationships
+    category = db.relationship('Category')
+
+    __table_args__ = (db.Index('ix_expenses_archive_user_id_date', 'user_id', 'date'),)
+
+# Per-month, per-category totals for archived years
+class ExpenseSummary(db.Model):
+    __tablename__ = 'expense_summaries'
+    id = db.Column(db.Integer, primary_key=True)
+    year = db.Column(db.Integer, nullable=False)
+    month = db.Column(db.Integer, nullable=False)
+    total = db.Column(Money(12), nullable=False)
+    count = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.String, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    category_id = db.Column(db.Integer, db.ForeignKey('categories.id'), nullable=False)
+
+    __table_args__ = (UniqueConstraint(
+        'user_id',
+        'year',
+        'month',
+        'category_id',
+        name='uq_expense_summary_user_year_month_category',
+    ),)
+
+# Which shard holds a user's tenant data (see sharding.py); lives in the main database
+class ShardAssignment(db.Model):
+    __tablename__ = 'shard_assignments'
+    user_id = db.Column(db.String, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    shard_key = db.Column(db.String(50), nullable=False)
+    moving_since = db.Column(db.DateTime, nullable=True)  # Set while rebalance-shards copies the user's rows
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+# Bumped on every change to a user's tenant data; keys the template fragment cache
+class UserDataVersion(db.Model):
+    __tablename__ = 'user_data_versions'
+    user_id = db.Column(db.String, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    categories_version = db.Column(db.Integer, nullable=False, default=0)  # Only bumped when categories change; keys category_cache.py
@@ -0,0 +1,149 @@
+"""Money columns stored as exact decimals or integer cents, and JSON output for them.
+
+Every money column uses the Money type. Python code always sees Decimal values
+with two decimal places; MONEY_STORAGE picks what the database stores:
+
+- "numeric" (default): NUMERIC(precision, 2) columns.
+- "cents": BIGINT columns holding integer cents, so SUM() and running totals
+  are exact integer arithmetic on every backend (SQLite sums NUMERIC columns
+  as floating point).
+
+Existing PostgreSQL databases are converted with
+`flask --app main convert-money-storage cents`, run with the old setting while
+the app is stopped: a worker still running in numeric mode would read cents as
+dollars, and PostgreSQL would round the 12.34 it writes into BIGINT to 12. Set
+MONEY_STORAGE afterwards and start the app again. The app refuses to start when
+the setting doesn't match the columns it finds.
+
+jsonify (and the tojson template filter) write Decimal values as plain JSON
+numbers instead of strings, using orjson when it is installed (the `json`
+extra); the stdlib encoder converts each Decimal through a Python callback.
+"""
+import os
+from decimal import ROUND_HALF_UP, Decimal
+
+import click
+import sqlalchemy as sa
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # Optional dependency, the stdlib json module is used without it
+    orjson = None
+
+STORE_CENTS = os.environ.get('MONEY_STORAGE', 'numeric') == 'cents'
+
+def to_cents(value):
+    """Convert an amount to integer cents, rounding half up"""
+    return int((Decimal(value) * 100).to_integral_value(ROUND_HALF_UP))
+
+def from_cents(cents):
+    """Convert integer cents to a Decimal amount"""
+    return Decimal(cents).scaleb(-2)
+
+class Money(sa.types.TypeDecorator):
+    """Decimal amount stored as NUMERIC(precision, 2) or as BIGINT cents (MONEY_STORAGE)"""
+    impl = sa.Numeric
+    cache_ok = True
+
+    def __init__(self, precision=10):
+        super().__init__(precision, 2)
+        self.precision = precision
+
+    def load_dialect_impl(self, dialect):
+        if STORE_CENTS:
+            return dialect.type_descriptor(sa.BigInteger())
+        return dialect.type_descriptor(sa.Numeric(self.precision, 2))
+
+    def process_bind_param(self, value, dialect):
+        if value is None or not STORE_CENTS:
+            return value
+        return to_cents(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if STORE_CENTS:
+            return from_cents(value)
+        return value
+
+class MoneyJSONProvider(DefaultJSONProvider):
+    """JSON provider that writes Decimal values as numbers, with orjson when available"""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, Decimal):
+            # The shortest float repr prints the same digits for up to 15 significant digits
+            return float(o)
+        return DefaultJSONProvider.default(o)
+
+    def dumps(self, obj, **kwargs):
+        # orjson only writes compact output (and leaves non-ASCII characters unescaped)
+        if orjson is None or kwargs.get('indent'):
+            return super().dumps(obj, **kwargs)
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if self.sort_keys else 0)
+        return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
+
+def money_columns(metadata, table_names):
+    """Yield (table, column) for every Money column of the given tables"""
+    for name in table_names:
+        for column in metadata.tables[name].columns:
+            if isinstance(column.type, Money):
+                yield metadata.tables[name], column
+
+def check_money_storage():
+    """Stop when MONEY_STORAGE doesn't match how the expenses tables store amounts"""
+    from sharding import all_shards, shard_engine
+
+    for shard_key in all_shards():
+        engine = shard_engine(shard_key)
+        columns = {column['name']: column['type'] for column in sa.inspect(engine).get_columns('expenses')}
+        stores_cents = isinstance(columns['amount'], sa.Integer)
+        if stores_cents != STORE_CENTS:
+            raise SystemExit(
+                f"MONEY_STORAGE doesn't match the {shard_key} database, which stores "
+                f"{'cents' if stores_cents else 'numeric'} amounts; run "
+                f"`flask --app main convert-money-storage` first or fix the setting"
+            )
+
+def init_money(app, db):
+    """Use the money-aware JSON provider and add the storage conversion command"""
+    from sharding import SHARDED_TABLES, all_shards, shard_engine
+
+    app.json = MoneyJSONProvider(app)
+    app.jinja_env.policies['json.dumps_function'] = app.json.dumps
+
+    @app.cli.command('convert-money-storage')
+    @click.argument('storage', type=click.Choice(['cents', 'numeric']))
+    def convert_money_storage_command(storage):
+        """Convert every money column to integer cents or NUMERIC (PostgreSQL only, with the app stopped)."""
+        to_cents_storage = storage == 'cents'
+        for shard_key in all_shards():
+            engine = shard_engine(shard_key)
+            if engine.dialect.name != 'postgresql':
+                raise click.ClickException("Column types can only be converted in place on PostgreSQL")
+
+            converted = 0
+            with engine.begin() as conn:
+                current = {
+                    (table.name, column['name']): column['type']
+                    for table in db.metadata.sorted_tables if table.name in SHARDED_TABLES
+                    for column in sa.inspect(conn).get_columns(table.name)
+                }
+                for table, column in money_columns(db.metadata, SHARDED_TABLES):
+                    stored = current.get((table.name, column.name))
+                    if stored is None or isinstance(stored, sa.Integer) == to_cents_storage:
+                        continue
+                    if to_cents_storage:
+                        conn.execute(sa.text(
+                            f"ALTER TABLE {table.name} ALTER COLUMN {column.name} "
+                            f"TYPE BIGINT USING round({column.name} * 100)"
+                        ))
+                    else:
+                        conn.execute(sa.text(
+                            f"ALTER TABLE {table.name} ALTER COLUMN {column.name} "
+                            f"TYPE NUMERIC({column.type.precision}, 2) USING {column.name} / 100.0"
+                        ))
+                    converted += 1
+            click.echo(f"{shard_key}: converted {converted} columns to {storage}")
+        click.echo(f"Now set MONEY_STORAGE={storage} and restart the app")
@@ -1,13 +1,54 @@
-from flask import render_template, request, redirect, url_for, flash, jsonify, session
-from flask_login import current_user
-from datetime import datetime, date
+from flask import render_template, request, redirect, url_for, flash, jsonify, session, Response, stream_with_context, abort
+from flask_login import current_user, logout_user
+from datetime import datetime, date, MINYEAR, MAXYEAR
 from decimal import Decimal
 import calendar
-from sqlalchemy import extract, func
+import csv
+import io
+from sqlalchemy import func
 
 from app import app, db
-from models import User, Expense, Budget, Category
+from models import User, Expense, Budget, Category, RecurringExpense
 from auth import require_login  # Import from our new auth system
+from archive import month_bounds, year_bounds, expenses_between, monthly_totals, iter_expenses_for_export
+from events import publish_event, stream_events
+from budget_tracking import apply_spending, start_budget
+from dashboard_data import load_dashboard
+from category_cache import user_categories, user_category
+from account import iter_account_export, schedule_account_deletion
+
+# Categories every new user starts with, as (name, color)
+DEFAULT_CATEGORIES = [
+    ('Food & Dining', '#e74c3c'),
+    ('Transportation', '#3498db'),
+    ('Shopping', '#9b59b6'),
+    ('Entertainment', '#f39c12'),
+    ('Bills & Utilities', '#1abc9c'),
+    ('Healthcare', '#e67e22'),
+    ('Education', '#34495e'),
+    ('Other', '#95a5a6')
+]
+
+def expense_event_data(expense, category):
+    return {
+        'id': expense.id,
+        'amount': float(expense.amount),
+        'date': expense.date.isoformat(),
+        'description': expense.description,
+        'category_id': category.id,
+        'category': category.name,
+        'color': category.color
+    }
+
+def publish_budget_alerts(user_id, alerts):
+    """Publish an event for every budget threshold that was just crossed"""
+    for alert in alerts:
+        publish_event(user_id, 'budget_threshold',
+                      budget_id=alert.budget_id,
+                      name=alert.budget.name,
+                      threshold=alert.threshold,
+                      spent=float(alert.spent),
+                      amount=float(alert.budget.amount))
 
 # Make session permanent
 @app.before_request
@@ -23,44 +64,8 @@ def index():
 @app.route('/dashboard')
 @require_login
 def dashboard():
-    # Get current month/year stats
-    current_month = datetime.now().month
-    current_year = datetime.now().year
-    
-    # Total expenses this month
-    monthly_expenses = db.session.query(func.sum(Expense.amount)).filter(
-        Expense.user_id == current_user.id,
-        extract('month', Expense.date) == current_month,
-        extract('year', Expense.date) == current_year
-    ).scalar() or 0
-    
-    # Total budget this month
-    monthly_budget = db.session.query(func.sum(Budget.amount)).filter(
-        Budget.user_id == current_user.id,
-        Budget.month == current_month,
-        Budget.year == current_year,
-        Budget.period == 'monthly'
-    ).scalar() or 0
-    
-    # Recent expenses
-    recent_expenses = Expense.query.filter_by(user_id=current_user.id).order_by(Expense.date.desc()).limit(5).all()
-    
-    # Categories with spending
-    categories_spending = db.session.query(
-        Category.name,
-        Category.color,
-        func.sum(Expense.amount).label('total')
-    ).join(Expense).filter(
-        Expense.user_id == current_user.id,
-        extract('month', Expense.date) == current_month,
-        extract('year', Expense.date) == current_year
-    ).group_by(Category.id).all()
-    
-    return render_template('dashboard.html', 
-                         monthly_expenses=monthly_expenses,
-                         monthly_budget=monthly_budget,
-                         recent_expenses=recent_expenses,
-                         categories_spending=categories_spending)
+    # All widgets (totals, category spending, recent expenses, budget alerts) in one query
+    return render_template('dashboard.html', dashboard=load_dashboard(current_user.id))
 
 @app.route('/expenses')
 @require_login
@@ -68,8 +73,8 @@ def expenses():
     page = request.args.get('page', 1, type=int)
     expenses_list = Expense.query.filter_by(user_id=current_user.id).order_by(Expense.date.desc()).paginate(
         page=page, per_page=20, error_out=False)
-    categories = Category.query.filter_by(user_id=current_user.id).all()
-    return render_template('expenses.html', expenses=expenses_list, categories=categories)
+    category_map = user_categories(current_user.id)
+    return render_template('expenses.html', expenses=expenses_list, categories=category_map.values(), category_map=category_map)
 
 @app.route('/expenses/add', methods=['POST'])
 @require_login
@@ -81,7 +86,7 @@ def add_expense():
         category_id = int(request.form['category_id'])
         
         # Verify category belongs to user
-        category = Category.query.filter_by(id=category_id, user_id=current_user.id).first()
+        category = user_category(current_user.id, category_id)
         if not category:
             flash('Invalid category selected.', 'error')
             return redirect(url_for('expenses'))
@@ -95,7 +100,27 @@ def add_expense():
         )
         
         db.session.add(expense)
+        
+        # Optionally repeat this expense; the scheduler materializes later occurrences
+        repeat = request.form.get('repeat', '')
+        if repeat in RecurringExpense.RULES:
+            recurring = RecurringExpense(
+                amount=amount,
+                description=description,
+                rule=repeat,
+                anchor_day=expense_date.day,
+                user_id=current_user.id,
+                category_id=category_id
+            )
+            recurring.next_run = recurring.following_run(expense_date)
+            db.session.add(recurring)
+        
+        # Keep the running budget totals current and record any thresholds crossed
+        alerts = apply_spending(current_user.id, category_id, expense_date, amount)
+        
         db.session.commit()
+        publish_event(current_user.id, 'expense_added', **expense_event_data(expense, category))
+        publish_budget_alerts(current_user.id, alerts)
         flash('Expense added successfully!', 'success')
         
     except Exception as e:
@@ -109,13 +134,36 @@ def add_expense():
 def delete_expense(expense_id):
     expense = Expense.query.filter_by(id=expense_id, user_id=current_user.id).first()
     if expense:
+        event_data = expense_event_data(expense, user_category(current_user.id, expense.category_id))
+        apply_spending(current_user.id, expense.category_id, expense.date, -expense.amount)
         db.session.delete(expense)
         db.session.commit()
+        publish_event(current_user.id, 'expense_deleted', **event_data)
         flash('Expense deleted successfully!', 'success')
     else:
         flash('Expense not found.', 'error')
     return redirect(url_for('expenses'))
 
+@app.route('/recurring-expenses')
+@require_login
+def recurring_expenses():
+    rules = RecurringExpense.query.filter_by(user_id=current_user.id).order_by(
+        RecurringExpense.is_active.desc(), RecurringExpense.next_run).all()
+    return render_template('recurring_expenses.html', rules=rules, category_map=user_categories(current_user.id))
+
+@app.route('/recurring-expenses/<int:rule_id>/stop', methods=['POST'])
+@require_login
+def stop_recurring_expense(rule_id):
+    rule = RecurringExpense.query.filter_by(id=rule_id, user_id=current_user.id).first()
+    if rule:
+        # Expenses already created stay; the scheduler only picks up active rules
+        rule.is_active = False
+        db.session.commit()
+        flash('Recurring expense stopped.', 'success')
+    else:
+        flash('Recurring expense not found.', 'error')
+    return redirect(url_for('recurring_expenses'))
+
 @app.route('/budgets')
 @require_login
 def budgets():
@@ -123,32 +171,17 @@ def budgets():
     year = request.args.get('year', current_year, type=int)
     
     budgets_list = Budget.query.filter_by(user_id=current_user.id, year=year).order_by(Budget.month).all()
-    categories = Category.query.filter_by(user_id=current_user.id).all()
+    category_map = user_categories(current_user.id)
     
-    # Calculate actual spending for each budget
-    budget_data = []
-    for budget in budgets_list:
-        if budget.period == 'monthly':
-            actual_spending = db.session.query(func.sum(Expense.amount)).filter(
-                Expense.user_id == current_user.id,
-                Expense.category_id == budget.category_id,
-                extract('month', Expense.date) == budget.month,
-                extract('year', Expense.date) == budget.year
-            ).scalar() or 0
-        else:  # yearly
-            actual_spending = db.session.query(func.sum(Expense.amount)).filter(
-                Expense.user_id == current_user.id,
-                Expense.category_id == budget.category_id,
-                extract('year', Expense.date) == budget.year
-            ).scalar() or 0
-        
-        budget_data.append({
-            'budget': budget,
-            'actual': actual_spending,
-            'percentage': (actual_spending / budget.amount * 100) if budget.amount > 0 else 0
-        })
+    # Spending is kept up to date as expenses are written, no need to re-sum
+    budget_data = [{
+        'budget': budget,
+        'actual': budget.spent,
+        'percentage': budget.percentage
+    } for budget in budgets_list]
     
-    return render_template('budgets.html', budget_data=budget_data, categories=categories, current_year=year)
+    return render_template('budgets.html', budget_data=budget_data, categories=category_map.values(),
+                           category_map=category_map, current_year=year)
 
 @app.route('/budgets/add', methods=['POST'])
 @require_login
@@ -162,8 +195,7 @@ def add_budget():
         category_id = int(request.form['category_id'])
         
         # Verify category belongs to user
-        category = Category.query.filter_by(id=category_id, user_id=current_user.id).first()
-        if not category:
+        if not user_category(current_user.id, category_id):
             flash('Invalid category selected.', 'error')
             return redirect(url_for('budgets'))
         
@@ -178,7 +210,9 @@ def add_budget():
         )
         
         db.session.add(budget)
+        alerts = start_budget(budget)
         db.session.commit()
+        publish_budget_alerts(current_user.id, alerts)
         flash('Budget added successfully!', 'success')
         
     except Exception as e:
@@ -204,21 +238,29 @@ def delete_budget(budget_id):
 def analytics():
     return render_template('analytics.html')
 
+def requested_period(default_to_now=True):
+    """Get the ?year= and ?month= of the request, defaulting to now or None; 400 outside the calendar"""
+    now = datetime.now()
+    year = request.args.get('year', now.year if default_to_now else None, type=int)
+    month = request.args.get('month', now.month if default_to_now else None, type=int)
+    # year_bounds and month_bounds end on January 1st of the following year
+    if (year is not None and not MINYEAR <= year < MAXYEAR) or (month is not None and not 1 <= month <= 12):
+        abort(400)
+    return year, month
+
 @app.route('/api/analytics/monthly-spending')
 @require_login
 def api_monthly_spending():
-    year = request.args.get('year', datetime.now().year, type=int)
+    year, _ = requested_period()
     
+    # One grouped query instead of one per month; archived years read summary rows
+    totals = monthly_totals(current_user.id, year)
     monthly_data = []
     for month in range(1, 13):
-        total = db.session.query(func.sum(Expense.amount)).filter(
-            Expense.user_id == current_user.id,
-            extract('month', Expense.date) == month,
-            extract('year', Expense.date) == year
-        ).scalar() or 0
+        total = totals.get(month, 0)
         monthly_data.append({
             'month': calendar.month_abbr[month],
-            'amount': float(total)
+            'amount': total
         })
     
     return jsonify(monthly_data)
@@ -226,40 +268,51 @@ def api_monthly_spending():
 @app.route('/api/analytics/category-breakdown')
 @require_login
 def api_category_breakdown():
-    year = request.args.get('year', datetime.now().year, type=int)
-    month = request.args.get('month', datetime.now().month, type=int)
+    year, month = requested_period()
+    month_start, month_end = month_bounds(year, month)
     
+    # Aggregate by id only, names and colors come from the cached category map
     category_data = db.session.query(
-        Category.name,
-        Category.color,
+        Expense.category_id,
         func.sum(Expense.amount).label('total')
-    ).join(Expense).filter(
+    ).filter(
         Expense.user_id == current_user.id,
-        extract('month', Expense.date) == month,
-        extract('year', Expense.date) == year
-    ).group_by(Category.id).all()
+        Expense.date >= month_start,
+        Expense.date < month_end
+    ).group_by(Expense.category_id).all()
     
+    category_map = user_categories(current_user.id)
     data = [{
-        'category': item.name,
-        'color': item.color,
-        'amount': float(item.total)
+        'category': category_map[item.category_id].name,
+        'color': category_map[item.category_id].color,
+        'amount': item.total
     } for item in category_data]
     
     return jsonify(data)
 
+# Server-sent events with live changes for the dashboard and analytics pages
+@app.route('/events')
+@require_login
+def events():
+    if not app.config['LIVE_UPDATES']:
+        abort(404)
+    stream = stream_events(current_user.id)
+    # Idle streams must not keep a database connection checked out
+    db.session.remove()
+    return Response(
+        stream,
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 # Monthly Summary Route (from your old code)
 @app.route('/monthly-summary')
 @require_login
 def monthly_summary():
-    year = request.args.get('year', datetime.now().year, type=int)
-    month = request.args.get('month', datetime.now().month, type=int)
+    year, month = requested_period()
     
-    # Get expenses for specific month
-    monthly_expenses = Expense.query.filter(
-        Expense.user_id == current_user.id,
-        extract('month', Expense.date) == month,
-        extract('year', Expense.date) == year
-    ).order_by(Expense.date.desc()).all()
+    # Get expenses for specific month (reads the archive for closed years)
+    monthly_expenses = expenses_between(current_user.id, *month_bounds(year, month))
     
     # Calculate total
     total_amount = sum(expense.amount for expense in monthly_expenses)
@@ -276,6 +329,7 @@ def monthly_summary():
     
     return render_template('monthly_summary.html', 
                          expenses=monthly_expenses,
+                         category_map=user_categories(current_user.id),
                          total_amount=total_amount,
                          budget_amount=budget_amount,
                          month=month,
@@ -286,13 +340,10 @@ def monthly_summary():
 @app.route('/yearly-summary')
 @require_login
 def yearly_summary():
-    year = request.args.get('year', datetime.now().year, type=int)
+    year, _ = requested_period()
     
-    # Get expenses for specific year
-    yearly_expenses = Expense.query.filter(
-        Expense.user_id == current_user.id,
-        extract('year', Expense.date) == year
-    ).order_by(Expense.date.desc()).all()
+    # Get expenses for specific year (reads the archive for closed years)
+    yearly_expenses = expenses_between(current_user.id, *year_bounds(year))
     
     # Calculate total
     total_amount = sum(expense.amount for expense in yearly_expenses)
@@ -310,6 +361,7 @@ def yearly_summary():
     
     return render_template('yearly_summary.html',
                          expenses=yearly_expenses,
+                         category_map=user_categories(current_user.id),
                          total_amount=total_amount,
                          year=year,
                          monthly_breakdown=monthly_breakdown)
@@ -318,21 +370,54 @@ def yearly_summary():
 @app.route('/export-csv')
 @require_login
 def export_csv():
-    from flask import Response
-    # Get all expenses for current user
-    expenses = Expense.query.filter_by(user_id=current_user.id).order_by(Expense.date.desc()).all()
+    # Checked before the response starts streaming
+    year, month = requested_period(default_to_now=False)
+    # Current and archived expenses, optionally limited to a year or month
+    expenses = iter_expenses_for_export(current_user.id, year, month)
+    category_map = user_categories(current_user.id)
     
-    # Create CSV content
-    output = "Date,Category,Amount,Description\\n"
-    for expense in expenses:
-        output += f"{expense.date},{expense.category.name},{expense.amount},{expense.description}\\n"
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(['Date', 'Category', 'Amount', 'Description'])
+        for expense in expenses:
+            writer.writerow([expense.date, category_map[expense.category_id].name, expense.amount, expense.description])
+            if buffer.tell() > 8192:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate(0)
+        yield buffer.getvalue()
     
     return Response(
-        output,
+        stream_with_context(generate()),
         mimetype="text/csv",
         headers={"Content-Disposition": "attachment;filename=expenses.csv"}
     )
 
+@app.route('/account/export')
+@require_login
+def export_account():
+    # Zip of JSON lines files, streamed while it is being built
+    return Response(
+        stream_with_context(iter_account_export(current_user.id)),
+        mimetype="application/zip",
+        headers={"Content-Disposition": "attachment;filename=expense-tracker-account.zip"}
+    )
+
+@app.route('/account/delete', methods=['POST'])
+@require_login
+def delete_account():
+    if current_user.password_hash and not current_user.check_password(request.form.get('password', '')):
+        flash('Incorrect password. Your account was not deleted.', 'error')
+        return redirect(request.referrer or url_for('dashboard'))
+
+    user_id = current_user.id
+    logout_user()
+    # The account is marked right away; removing every row can take a while, so it happens in the background
+    schedule_account_deletion(user_id)
+    flash('Your account is being deleted.', 'info')
+    return redirect(url_for('index'))
+
 @app.route('/categories/add', methods=['POST'])
 @require_login
 def add_category():
@@ -347,6 +432,7 @@ def add_category():
         )
         
         db.session.add(category)
+        # The commit bumps the user's data version, which invalidates the cached category map
         db.session.commit()
         flash('Category added successfully!', 'success')
         
@@ -360,19 +446,8 @@ def add_category():
 @app.before_request
 def init_default_categories():
     if current_user.is_authenticated:
-        if not Category.query.filter_by(user_id=current_user.id).first():
-            default_categories = [
-                ('Food & Dining', '#e74c3c'),
-                ('Transportation', '#3498db'),
-                ('Shopping', '#9b59b6'),
-                ('Entertainment', '#f39c12'),
-                ('Bills & Utilities', '#1abc9c'),
-                ('Healthcare', '#e67e22'),
-                ('Education', '#34495e'),
-                ('Other', '#95a5a6')
-            ]
-            
-            for name, color in default_categories:
+        if not user_categories(current_user.id):
+            for name, color in DEFAULT_CATEGORIES:
                 category = Category(name=name, color=color, user_id=current_user.id)
                 db.session.add(category)
             
@@ -0,0 +1,111 @@
+"""Materialize due recurring expenses into regular Expense rows.
+
+Run with `flask --app main materialize-recurring` (e.g. from cron). Several
+workers can run it at the same time: every batch of rules is claimed with
+SELECT ... FOR UPDATE SKIP LOCKED, so a rule is only ever expanded by the
+worker holding its row lock, and the lock is released when the batch commits.
+"""
+import logging
+from datetime import date
+
+import click
+from sqlalchemy import insert, select, update
+
+from app import app, db
+from models import Expense, RecurringExpense
+from budget_tracking import apply_bulk_spending
+from sharding import all_shards, moving_user_ids, use_shard
+from account import deleting_user_ids
+from templating import touch_user_data
+
+DEFAULT_BATCH_SIZE = 500  # Rules claimed per transaction
+INSERT_CHUNK_SIZE = 5000  # Expense rows sent per INSERT statement
+
+def claim_due_rules(today, batch_size):
+    """Lock and return up to `batch_size` rules that are due, skipping rows other workers hold"""
+    stmt = select(RecurringExpense).where(
+        RecurringExpense.is_active.is_(True),
+        RecurringExpense.next_run <= today,
+        # Users being moved to another shard wait for the next run, deleted accounts get nothing new
+        RecurringExpense.user_id.not_in(moving_user_ids(db) | deleting_user_ids())
+    ).order_by(RecurringExpense.id).limit(batch_size).with_for_update(skip_locked=True)
+    return db.session.scalars(stmt).all()
+
+def materialize_rules(rules, today):
+    """Insert every missed occurrence of the claimed rules and move their next_run forward"""
+    created = 0
+    expense_rows = []
+    rule_updates = []
+
+    for rule in rules:
+        run = rule.next_run
+        # A catch-up after downtime can produce many occurrences per rule
+        while run <= today and (rule.end_date is None or run <= rule.end_date):
+            expense_rows.append({
+                'amount': rule.amount,
+                'description': rule.description,
+                'date': run,
+                'user_id': rule.user_id,
+                'category_id': rule.category_id,
+            })
+            run = rule.following_run(run)
+
+            if len(expense_rows) >= INSERT_CHUNK_SIZE:
+                db.session.execute(insert(Expense), expense_rows)
+                apply_bulk_spending(expense_rows)
+                created += len(expense_rows)
+                expense_rows = []
+
+        rule_updates.append({
+            'id': rule.id,
+            'next_run': run,
+            'is_active': rule.end_date is None or run <= rule.end_date,
+        })
+
+    if expense_rows:
+        db.session.execute(insert(Expense), expense_rows)
+        apply_bulk_spending(expense_rows)
+        created += len(expense_rows)
+
+    # Bulk UPDATE by primary key, one statement for the whole batch
+    db.session.execute(update(RecurringExpense), rule_updates)
+    # Bulk statements skip the unit of work, so flag the users for cache invalidation
+    touch_user_data(db.session, {rule.user_id for rule in rules})
+    return created
+
+def materialize_due_expenses(today=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Process due rules on every shard; returns the number of expenses created"""
+    today = today or date.today()
+    created = 0
+    for shard_key in all_shards():
+        with use_shard(shard_key):
+            created += _materialize_shard(today, batch_size)
+
+    logging.info("Materialized %d recurring expenses up to %s", created, today)
+    return created
+
+def _materialize_shard(today, batch_size):
+    """Process due rules batch by batch until none are left"""
+    created = 0
+    while True:
+        try:
+            rules = claim_due_rules(today, batch_size)
+            if not rules:
+                db.session.rollback()
+                break
+            created += materialize_rules(rules, today)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    return created
+
+@app.cli.command('materialize-recurring')
+@click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True,
+              help='Number of recurring rules claimed per transaction.')
+@click.option('--date', 'run_date', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='Materialize occurrences up to this date (defaults to today).')
+def materialize_recurring_command(batch_size, run_date):
+    """Generate expenses for every recurring rule that is due."""
+    created = materialize_due_expenses(run_date.date() if run_date else None, batch_size)
+    click.echo(f"Created {created} expenses")
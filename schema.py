@@ -0,0 +1,93 @@
+"""Schema upgrades for databases created by earlier versions of the app.
+
+`db.create_all()` only creates missing tables, so columns that were added to
+existing tables later are added at startup, on the main database and every
+shard, before anything queries them.
+
+Indexes declared after a table was created are not built at startup, since
+building one blocks writes to the table and every worker would race to do it.
+The startup check only warns about them; `flask --app main create-indexes`
+builds them, with CREATE INDEX CONCURRENTLY on PostgreSQL.
+"""
+import logging
+
+import click
+import sqlalchemy as sa
+
+from sharding import DEFAULT_SHARD, SHARDED_TABLES, all_shards, shard_engine
+
+def _add_column(engine, model, name, default=None):
+    """Add a column where it is missing; NOT NULL columns need a `default` for existing rows"""
+    table = model.__table__
+    if name in {column['name'] for column in sa.inspect(engine).get_columns(table.name)}:
+        return False
+    column_type = table.c[name].type.compile(dialect=engine.dialect)
+    if default is not None:
+        column_type += f" NOT NULL DEFAULT {default}"
+    with engine.begin() as conn:
+        conn.execute(sa.text(f"ALTER TABLE {table.name} ADD COLUMN {name} {column_type}"))
+    logging.info("Added %s.%s", table.name, name)
+    return True
+
+def _shard_databases(db):
+    """Yield every shard key with its engine and the tables it holds"""
+    # Extra shards only hold the tenant tables
+    shard_tables = [db.metadata.tables[name] for name in SHARDED_TABLES]
+    for shard_key in all_shards():
+        if shard_key == DEFAULT_SHARD:
+            yield shard_key, db.engines[None], db.metadata.sorted_tables
+        else:
+            yield shard_key, shard_engine(shard_key), shard_tables
+
+def missing_indexes(engine, tables):
+    """Get the declared indexes of `tables` that the database doesn't have"""
+    inspector = sa.inspect(engine)
+    missing = []
+    for table in tables:
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        missing.extend(index for index in table.indexes if index.name not in existing)
+    return missing
+
+def _is_partitioned(conn, table_name):
+    return conn.execute(
+        sa.text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:name)"), {'name': table_name}
+    ).scalar()
+
+def create_index(engine, index):
+    """Build an index without blocking writes where the database supports it"""
+    columns = ', '.join(column.name for column in index.columns)
+    unique = 'UNIQUE ' if index.unique else ''
+    # CONCURRENTLY can't run inside a transaction
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        concurrently = ''
+        # Partitioned tables (see partition-expenses) can't be indexed concurrently
+        if engine.dialect.name == 'postgresql' and not _is_partitioned(conn, index.table.name):
+            concurrently = 'CONCURRENTLY '
+        conn.execute(sa.text(
+            f"CREATE {unique}INDEX {concurrently}IF NOT EXISTS {index.name} ON {index.table.name} ({columns})"
+        ))
+
+def upgrade_schema(db):
+    """Add the columns older databases are missing and report missing indexes, on every shard"""
+    from models import Budget, User
+
+    _add_column(db.engines[None], User, 'deletion_requested_at')
+    for shard_key, engine, tables in _shard_databases(db):
+        if _add_column(engine, Budget, 'spent', default=0):
+            logging.warning("Budget totals on %s start at 0, run `flask --app main rebuild-budget-spending`", shard_key)
+        missing = missing_indexes(engine, tables)
+        if missing:
+            logging.warning("%s is missing indexes %s, run `flask --app main create-indexes`",
+                            shard_key, ', '.join(index.name for index in missing))
+
+def init_schema(app, db):
+    """Register the create-indexes command"""
+
+    @app.cli.command('create-indexes')
+    def create_indexes_command():
+        """Build the declared indexes missing from the main database and every shard."""
+        for shard_key, engine, tables in _shard_databases(db):
+            for index in missing_indexes(engine, tables):
+                create_index(engine, index)
+                logging.info("Created index %s on %s", index.name, shard_key)
+                click.echo(f"{shard_key}: created {index.name}")
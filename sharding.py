@@ -0,0 +1,334 @@
+"""Horizontal sharding of tenant data by user id.
+
+Users (and auth tables) always live in the main database. Tenant tables in
+SHARDED_TABLES can additionally be spread over the databases listed in the
+SHARD_DATABASE_URLS environment variable, as comma separated name=url pairs
+(e.g. "shard_a=postgresql://db-a/app,shard_b=postgresql://db-b/app"). The
+main database is part of the ring as the "default" shard, so existing installs
+keep working unchanged.
+
+Shard names are stored in shard_assignments, so they must never change or be
+reused for another database. The app refuses to start while users are
+assigned to a shard that is no longer configured.
+
+New users are placed with a consistent hash ring over the shard keys, and the
+placement is recorded in the shard_assignments table. Adding a shard only moves
+roughly 1/n of the users, which `flask --app main rebalance-shards` copies over.
+While a user is being moved their assignment is marked `moving_since`: write
+requests get a 503 and the recurring expense scheduler skips them, so nothing
+is written to the source after its rows have been copied.
+
+Queries on tenant tables go to the shard selected for the current request (or
+the one set with `use_shard` in CLI commands); ShardedSession does the routing.
+"""
+import bisect
+import hashlib
+import logging
+import os
+import re
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import click
+import sqlalchemy as sa
+from flask import abort, current_app, g, has_app_context, make_response, request
+from flask_login import current_user
+from flask_sqlalchemy.session import Session
+from sqlalchemy.exc import IntegrityError
+
+DEFAULT_SHARD = 'default'
+
+_SHARD_URL = re.compile(r'^\s*([A-Za-z_][\w-]*)\s*=\s*(\S.*?)\s*$')
+
+# Tenant tables in foreign key order, parents first
+SHARDED_TABLES = (
+    'categories',
+    'expenses',
+    'budgets',
+    'budget_alerts',
+    'recurring_expenses',
+    'expenses_archive',
+    'expense_summaries',
+)
+
+# Columns pointing at other tenant tables, whose ids change when a user moves
+ID_REFERENCES = {
+    'category_id': 'categories',
+    'budget_id': 'budgets',
+}
+
+def _hash(value):
+    return int(hashlib.md5(value.encode('utf-8')).hexdigest()[:16], 16)
+
+class ShardRouter:
+    """Consistent hash ring mapping user ids to shard keys"""
+
+    def __init__(self, shard_keys, replicas=100):
+        self.shard_keys = list(shard_keys)
+        ring = sorted((_hash(f"{key}#{i}"), key) for key in self.shard_keys for i in range(replicas))
+        self._points = [point for point, _ in ring]
+        self._keys = [key for _, key in ring]
+
+    def shard_for(self, user_id):
+        """Get the shard a user belongs on according to the ring"""
+        index = bisect.bisect(self._points, _hash(str(user_id))) % len(self._points)
+        return self._keys[index]
+
+def _sharded_table(mapper, clause):
+    if mapper is not None:
+        table = sa.inspect(mapper).local_table
+        return table if table.name in SHARDED_TABLES else None
+    if clause is not None:
+        for table in sa.sql.util.find_tables(clause, include_crud=True):
+            if table.name in SHARDED_TABLES:
+                return table
+    return None
+
+class ShardedSession(Session):
+    """Session that sends tenant tables to the shard of the current user"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        router = current_app.extensions.get('shard_router') if has_app_context() else None
+        if bind is None and router is not None and _sharded_table(mapper, clause) is not None:
+            shard_key = g.get('shard_key')
+            if shard_key is None:
+                raise RuntimeError("No shard selected for a query on a sharded table")
+            return shard_engine(shard_key)
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def shard_engine(shard_key):
+    """Get the engine of a shard"""
+    db = current_app.extensions['sqlalchemy']
+    return db.engines[None if shard_key == DEFAULT_SHARD else shard_key]
+
+def all_shards():
+    """Get every shard key, just the default one when sharding is off"""
+    router = current_app.extensions.get('shard_router')
+    return router.shard_keys if router else [DEFAULT_SHARD]
+
+@contextmanager
+def use_shard(shard_key):
+    """Route tenant queries to `shard_key` for the duration of the block"""
+    previous = g.get('shard_key')
+    g.shard_key = shard_key
+    try:
+        yield
+    finally:
+        g.shard_key = previous
+
+def shard_for_user(user_id):
+    """Get the shard holding a user's data, assigning one on first use"""
+    from models import Category, ShardAssignment
+
+    db = current_app.extensions['sqlalchemy']
+    assignment = db.session.get(ShardAssignment, user_id)
+    if assignment:
+        return assignment.shard_key
+
+    # Users from before sharding have their data in the main database
+    with use_shard(DEFAULT_SHARD):
+        has_legacy_data = Category.query.filter_by(user_id=user_id).first() is not None
+    shard_key = DEFAULT_SHARD if has_legacy_data else current_app.extensions['shard_router'].shard_for(user_id)
+
+    db.session.add(ShardAssignment(user_id=user_id, shard_key=shard_key))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent first request assigned the user first
+        db.session.rollback()
+        shard_key = db.session.get(ShardAssignment, user_id).shard_key
+    return shard_key
+
+def _shard_metadata(metadata):
+    """Copy the tenant tables without their foreign keys to users, which only exist in the main database"""
+    shard_metadata = sa.MetaData()
+    for name in SHARDED_TABLES:
+        table = metadata.tables[name].to_metadata(shard_metadata)
+        for constraint in list(table.foreign_key_constraints):
+            if constraint.elements[0].target_fullname.startswith('users.'):
+                table.constraints.discard(constraint)
+                table.foreign_keys.difference_update(constraint.elements)
+                for column in constraint.columns:
+                    column.foreign_keys.difference_update(constraint.elements)
+    return shard_metadata
+
+def moving_user_ids(db):
+    """Get the ids of the users whose rows are being moved between shards"""
+    from models import ShardAssignment
+
+    return set(db.session.scalars(sa.select(ShardAssignment.user_id).where(ShardAssignment.moving_since.is_not(None))))
+
+def mark_moving(db, moves):
+    """Flag users as moving so their writes stop; `moves` maps user ids to their current shard"""
+    from models import ShardAssignment
+
+    for user_id, source in moves.items():
+        assignment = db.session.get(ShardAssignment, user_id)
+        if assignment is None:
+            assignment = ShardAssignment(user_id=user_id, shard_key=source)
+            db.session.add(assignment)
+        assignment.moving_since = datetime.now()
+    db.session.commit()
+
+def move_user(db, user_id, source, target):
+    """Copy a user's tenant rows from one shard to another, then delete them from the source
+
+    The user must have been flagged with `mark_moving` first, and in-flight
+    requests given time to finish; the flag is cleared when the move ends.
+    """
+    from models import ShardAssignment
+    from templating import touch_user_data
+
+    assignment = db.session.get(ShardAssignment, user_id)
+    try:
+        moved = _copy_user_rows(db.metadata, user_id, source, target)
+    except Exception:
+        db.session.rollback()
+        assignment.moving_since = None
+        db.session.commit()
+        raise
+
+    assignment.shard_key = target
+    assignment.moving_since = None
+    # Row ids changed, so cached fragments and categories for this user are stale
+    touch_user_data(db.session, [user_id], categories=True)
+    db.session.commit()
+
+    with shard_engine(source).begin() as source_conn:
+        for name in reversed(SHARDED_TABLES):
+            table = db.metadata.tables[name]
+            source_conn.execute(sa.delete(table).where(table.c.user_id == user_id))
+
+    return moved
+
+def _copy_user_rows(metadata, user_id, source, target):
+    id_maps = {parent: {} for parent in ID_REFERENCES.values()}
+    moved = 0
+
+    with shard_engine(target).begin() as target_conn:
+        # Drop leftovers of an interrupted earlier move before copying
+        for name in reversed(SHARDED_TABLES):
+            table = metadata.tables[name]
+            target_conn.execute(sa.delete(table).where(table.c.user_id == user_id))
+
+        with shard_engine(source).connect() as source_conn:
+            for name in SHARDED_TABLES:
+                table = metadata.tables[name]
+                rows = [dict(row) for row in source_conn.execute(
+                    sa.select(table).where(table.c.user_id == user_id).order_by(table.c.id)
+                ).mappings()]
+                if not rows:
+                    continue
+                # Ids are per database, so let the target assign new ones
+                old_ids = [row.pop('id') for row in rows]
+                for row in rows:
+                    for column, parent in ID_REFERENCES.items():
+                        if column in row:
+                            row[column] = id_maps[parent][row[column]]
+                if name in id_maps:
+                    new_ids = target_conn.execute(
+                        sa.insert(table).returning(table.c.id, sort_by_parameter_order=True), rows
+                    ).scalars().all()
+                    id_maps[name] = dict(zip(old_ids, new_ids))
+                else:
+                    target_conn.execute(sa.insert(table), rows)
+                moved += len(rows)
+    return moved
+
+def parse_shard_urls(spec):
+    """Parse "name=url,name=url" into a {shard key: url} mapping"""
+    shards = {}
+    for item in filter(str.strip, spec.split(',')):
+        match = _SHARD_URL.match(item)
+        if not match:
+            raise SystemExit(f"SHARD_DATABASE_URLS entries must be name=url, got {item.strip()!r}")
+        name, url = match.groups()
+        if name == DEFAULT_SHARD or name in shards:
+            raise SystemExit(f"shard name {name!r} in SHARD_DATABASE_URLS is reserved or used twice")
+        shards[name] = url
+    return shards
+
+def init_sharding(app, db):
+    """Set up the shard ring from SHARD_DATABASE_URLS, if configured"""
+    shards = parse_shard_urls(os.environ.get('SHARD_DATABASE_URLS', ''))
+    if not shards:
+        return
+
+    app.config.setdefault('SQLALCHEMY_BINDS', {}).update(shards)
+    app.extensions['shard_router'] = ShardRouter([DEFAULT_SHARD] + list(shards))
+
+    @app.before_request
+    def select_user_shard():
+        if current_user.is_authenticated:
+            from models import ShardAssignment
+
+            g.shard_key = shard_for_user(current_user.id)
+            # Writes during a move would land on the source after its rows were copied
+            if request.method not in ('GET', 'HEAD'):
+                assignment = db.session.get(ShardAssignment, current_user.id)
+                if assignment is not None and assignment.moving_since is not None:
+                    abort(make_response(
+                        "Your data is being moved to a new database, please try again in a minute.",
+                        503, {'Retry-After': '60'}
+                    ))
+
+    @app.cli.command('rebalance-shards')
+    @click.option('--dry-run', is_flag=True, help='Only report which users would move.')
+    @click.option('--batch-size', default=100, show_default=True, help='Users whose writes are paused together.')
+    @click.option('--grace-seconds', default=30.0, show_default=True,
+                  help='Wait after pausing writes, so requests already writing can finish (the gunicorn timeout).')
+    def rebalance_shards_command(dry_run, batch_size, grace_seconds):
+        """Move users whose data is not on the shard the hash ring assigns them to.
+
+        Safe while the app is running: each batch of users gets write requests
+        refused (503) and is skipped by materialize-recurring until it has been
+        copied. Don't run archive-year at the same time.
+        """
+        from models import ShardAssignment, User
+
+        router = app.extensions['shard_router']
+        users = db.session.query(User.id, ShardAssignment.shard_key).outerjoin(
+            ShardAssignment, ShardAssignment.user_id == User.id
+        ).all()
+
+        moves = [(user_id, current or DEFAULT_SHARD, router.shard_for(user_id)) for user_id, current in users]
+        moves = [move for move in moves if move[1] != move[2]]
+        if dry_run:
+            for user_id, current, target in moves:
+                click.echo(f"{user_id}: {current} -> {target}")
+            click.echo(f"Would move {len(moves)} of {len(users)} users")
+            return
+
+        for start in range(0, len(moves), batch_size):
+            batch = moves[start:start + batch_size]
+            mark_moving(db, {user_id: current for user_id, current, _ in batch})
+            # Requests that passed the moving check just before may still be writing
+            time.sleep(grace_seconds)
+            for user_id, current, target in batch:
+                moved = move_user(db, user_id, current, target)
+                logging.info("Moved user %s from %s to %s (%d rows)", user_id, current, target, moved)
+
+        click.echo(f"Moved {len(moves)} of {len(users)} users")
+
+def check_shard_assignments(db):
+    """Stop when users are assigned to shards that are no longer configured"""
+    from models import ShardAssignment
+
+    assigned = db.session.scalars(sa.select(ShardAssignment.shard_key).distinct()).all()
+    missing = sorted(set(assigned) - set(all_shards()))
+    if missing:
+        raise SystemExit(
+            f"users are assigned to shards missing from SHARD_DATABASE_URLS: {', '.join(missing)}; "
+            f"shard names must stay attached to the same database"
+        )
+
+def create_shard_tables(app, db):
+    """Create the tenant tables on every extra shard"""
+    router = app.extensions.get('shard_router')
+    if router is None:
+        return
+    shard_metadata = _shard_metadata(db.metadata)
+    for shard_key in router.shard_keys:
+        if shard_key != DEFAULT_SHARD:
+            shard_metadata.create_all(shard_engine(shard_key))
@@ -187,64 +187,110 @@ async function updateSummaryCards(year, month) {
         const monthlyData = await monthlyResponse.json();
         const categoryData = await categoryResponse.json();
         
-        // Calculate summary statistics
-        const totalYearlySpending = monthlyData.reduce((sum, item) => sum + item.amount, 0);
-        const averageMonthlySpending = totalYearlySpending / 12;
-        const selectedMonthSpending = monthlyData.find(item => 
-            item.month === new Date(year, month - 1).toLocaleString('default', { month: 'short' })
-        )?.amount || 0;
+        renderSummaryCards(year, month, monthlyData, categoryData);
         
-        const topCategory = categoryData.reduce((max, item) => 
-            item.amount > (max?.amount || 0) ? item : max, null
-        );
-        
-        // Update summary cards
-        const summaryContainer = document.getElementById('summaryCards');
-        summaryContainer.innerHTML = `
-            <div class="col-md-3 mb-3">
-                <div class="card stat-card">
-                    <div class="card-body text-center">
-                        <i data-feather="calendar" class="text-primary mb-2" style="width: 32px; height: 32px;"></i>
-                        <h5 class="text-primary">$${totalYearlySpending.toFixed(2)}</h5>
-                        <small class="text-muted">Total Yearly Spending</small>
-                    </div>
+    } catch (error) {
+        console.error('Error updating summary cards:', error);
+    }
+}
+
+// Render the summary cards from monthly and category data
+function renderSummaryCards(year, month, monthlyData, categoryData) {
+    // Calculate summary statistics
+    const totalYearlySpending = monthlyData.reduce((sum, item) => sum + item.amount, 0);
+    const averageMonthlySpending = totalYearlySpending / 12;
+    const selectedMonthSpending = monthlyData.find(item => 
+        item.month === new Date(year, month - 1).toLocaleString('default', { month: 'short' })
+    )?.amount || 0;
+    
+    const topCategory = categoryData.reduce((max, item) => 
+        item.amount > (max?.amount || 0) ? item : max, null
+    );
+    
+    // Update summary cards
+    const summaryContainer = document.getElementById('summaryCards');
+    summaryContainer.innerHTML = `
+        <div class="col-md-3 mb-3">
+            <div class="card stat-card">
+                <div class="card-body text-center">
+                    <i data-feather="calendar" class="text-primary mb-2" style="width: 32px; height: 32px;"></i>
+                    <h5 class="text-primary">$${totalYearlySpending.toFixed(2)}</h5>
+                    <small class="text-muted">Total Yearly Spending</small>
                 </div>
             </div>
-            <div class="col-md-3 mb-3">
-                <div class="card stat-card">
-                    <div class="card-body text-center">
-                        <i data-feather="trending-up" class="text-success mb-2" style="width: 32px; height: 32px;"></i>
-                        <h5 class="text-success">$${averageMonthlySpending.toFixed(2)}</h5>
-                        <small class="text-muted">Average Monthly</small>
-                    </div>
+        </div>
+        <div class="col-md-3 mb-3">
+            <div class="card stat-card">
+                <div class="card-body text-center">
+                    <i data-feather="trending-up" class="text-success mb-2" style="width: 32px; height: 32px;"></i>
+                    <h5 class="text-success">$${averageMonthlySpending.toFixed(2)}</h5>
+                    <small class="text-muted">Average Monthly</small>
                 </div>
             </div>
-            <div class="col-md-3 mb-3">
-                <div class="card stat-card">
-                    <div class="card-body text-center">
-                        <i data-feather="dollar-sign" class="text-info mb-2" style="width: 32px; height: 32px;"></i>
-                        <h5 class="text-info">$${selectedMonthSpending.toFixed(2)}</h5>
-                        <small class="text-muted">Selected Month</small>
-                    </div>
+        </div>
+        <div class="col-md-3 mb-3">
+            <div class="card stat-card">
+                <div class="card-body text-center">
+                    <i data-feather="dollar-sign" class="text-info mb-2" style="width: 32px; height: 32px;"></i>
+                    <h5 class="text-info">$${selectedMonthSpending.toFixed(2)}</h5>
+                    <small class="text-muted">Selected Month</small>
                 </div>
             </div>
-            <div class="col-md-3 mb-3">
-                <div class="card stat-card">
-                    <div class="card-body text-center">
-                        <i data-feather="award" class="text-warning mb-2" style="width: 32px; height: 32px;"></i>
-                        <h5 class="text-warning">${topCategory?.category || 'N/A'}</h5>
-                        <small class="text-muted">Top Category</small>
-                    </div>
+        </div>
+        <div class="col-md-3 mb-3">
+            <div class="card stat-card">
+                <div class="card-body text-center">
+                    <i data-feather="award" class="text-warning mb-2" style="width: 32px; height: 32px;"></i>
+                    <h5 class="text-warning">${topCategory?.category || 'N/A'}</h5>
+                    <small class="text-muted">Top Category</small>
                 </div>
             </div>
-        `;
-        
-        // Re-initialize feather icons
-        feather.replace();
-        
-    } catch (error) {
-        console.error('Error updating summary cards:', error);
+        </div>
+    `;
+    
+    // Re-initialize feather icons
+    feather.replace();
+}
+
+// Apply an added (sign 1) or deleted (sign -1) expense pushed by the server
+function applyExpenseDelta(expense, sign) {
+    const year = document.getElementById('yearSelect').value;
+    const month = document.getElementById('monthSelect').value;
+    if (!isInPeriod(expense.date, year) || !monthlyChart) {
+        return;
+    }
+    
+    const delta = sign * expense.amount;
+    const monthIndex = Number(expense.date.split('-')[1]) - 1;
+    const monthlyValues = monthlyChart.data.datasets[0].data;
+    monthlyValues[monthIndex] = Math.max(0, monthlyValues[monthIndex] + delta);
+    monthlyChart.update();
+    
+    if (isInPeriod(expense.date, year, month)) {
+        if (!categoryChart) {
+            // No chart to patch yet (the month was empty), load it once
+            updateCategoryChart(year, month);
+            return;
+        }
+        const data = categoryChart.data;
+        const index = data.labels.indexOf(expense.category);
+        if (index === -1) {
+            data.labels.push(expense.category);
+            data.datasets[0].data.push(delta);
+            data.datasets[0].backgroundColor.push(expense.color);
+        } else {
+            data.datasets[0].data[index] = Math.max(0, data.datasets[0].data[index] + delta);
+        }
+        categoryChart.update();
     }
+    
+    // Recompute the summary cards from the patched charts
+    const monthlyData = monthlyChart.data.labels.map((label, i) => ({ month: label, amount: monthlyValues[i] }));
+    const categoryData = categoryChart ? categoryChart.data.labels.map((label, i) => ({
+        category: label,
+        amount: categoryChart.data.datasets[0].data[i]
+    })) : [];
+    renderSummaryCards(year, month, monthlyData, categoryData);
 }
 
 // Show empty chart state
@@ -352,6 +398,13 @@ document.addEventListener('DOMContentLoaded', function() {
     document.getElementById('yearSelect').addEventListener('change', updateCharts);
     document.getElementById('monthSelect').addEventListener('change', updateCharts);
     
+    // Patch the charts with changes pushed by the server instead of re-fetching
+    connectLiveUpdates({
+        expense_added: expense => applyExpenseDelta(expense, 1),
+        expense_deleted: expense => applyExpenseDelta(expense, -1),
+        budget_threshold: showBudgetAlert
+    });
+    
     // Add export button
     const title = document.querySelector('h1');
     if (title) {
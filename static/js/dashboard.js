@@ -1,5 +1,7 @@
 // Dashboard JavaScript functionality
 
+let categoryChart = null;
+
 // Initialize category chart
 function initCategoryChart(categoryData) {
     const ctx = document.getElementById('categoryChart');
@@ -12,7 +14,7 @@ function initCategoryChart(categoryData) {
     const data = categoryData.map(item => parseFloat(item[2])); // total amount
     const colors = categoryData.map(item => item[1]); // category color
 
-    new Chart(ctx, {
+    categoryChart = new Chart(ctx, {
         type: 'doughnut',
         data: {
             labels: labels,
@@ -111,6 +113,13 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     });
     
+    // Apply changes pushed by the server instead of polling
+    connectLiveUpdates({
+        expense_added: expense => applyExpenseDelta(expense, 1),
+        expense_deleted: expense => applyExpenseDelta(expense, -1),
+        budget_threshold: showBudgetAlert
+    });
+    
     // Initialize tooltips
     const tooltipTriggerList = [].slice.call(document.querySelectorAll('[data-bs-toggle="tooltip"]'));
     tooltipTriggerList.map(function (tooltipTriggerEl) {
@@ -118,18 +127,58 @@ document.addEventListener('DOMContentLoaded', function() {
     });
 });
 
-// Refresh dashboard data
+// Refresh the stat cards and progress bar from the current totals
 function refreshDashboard() {
-    // Add loading state
-    const container = document.querySelector('.container');
-    container.classList.add('loading');
+    const spendingElement = document.getElementById('monthlySpending');
+    const budgetElement = document.getElementById('monthlyBudget');
+    if (!spendingElement || !budgetElement) {
+        return;
+    }
+    
+    const spent = parseFloat(spendingElement.dataset.value) || 0;
+    const budget = parseFloat(budgetElement.dataset.value) || 0;
+    const percentage = budget > 0 ? (spent / budget * 100) : 0;
+    
+    spendingElement.textContent = '$' + spent.toFixed(2);
+    document.getElementById('monthlyRemaining').textContent = '$' + (budget - spent).toFixed(2);
+    document.getElementById('budgetUsed').textContent = percentage.toFixed(1) + '%';
+    document.getElementById('progressSpent').textContent = 'Spent: $' + spent.toFixed(2);
+    
+    const progressBar = document.getElementById('budgetProgress');
+    progressBar.style.width = percentage + '%';
+    progressBar.textContent = percentage.toFixed(1) + '%';
+}
+
+// Apply an added (sign 1) or deleted (sign -1) expense pushed by the server
+function applyExpenseDelta(expense, sign) {
+    const now = new Date();
+    if (!isInPeriod(expense.date, now.getFullYear(), now.getMonth() + 1)) {
+        return;
+    }
     
-    // Simulate API call and refresh
-    setTimeout(() => {
-        container.classList.remove('loading');
-        // In a real app, you would fetch new data here
-        location.reload();
-    }, 1000);
+    const spendingElement = document.getElementById('monthlySpending');
+    const spent = (parseFloat(spendingElement.dataset.value) || 0) + sign * expense.amount;
+    spendingElement.dataset.value = spent;
+    refreshDashboard();
+    
+    const delta = sign * expense.amount;
+    if (!categoryChart) {
+        if (delta > 0) {
+            initCategoryChart([[expense.category, expense.color, delta]]);
+        }
+        return;
+    }
+    
+    const data = categoryChart.data;
+    const index = data.labels.indexOf(expense.category);
+    if (index === -1) {
+        data.labels.push(expense.category);
+        data.datasets[0].data.push(delta);
+        data.datasets[0].backgroundColor.push(expense.color);
+    } else {
+        data.datasets[0].data[index] = Math.max(0, data.datasets[0].data[index] + delta);
+    }
+    categoryChart.update();
 }
 
 // Update budget progress bars
@@ -0,0 +1,39 @@
+// Live updates pushed by the server over server-sent events
+
+// Open the event stream and hand each event type to its handler
+function connectLiveUpdates(handlers) {
+    // The server only accepts streams when it can hold them (LIVE_UPDATES)
+    if (!window.EventSource || !('liveUpdates' in document.body.dataset)) {
+        return null;
+    }
+
+    // EventSource reconnects on its own after network errors
+    const source = new EventSource('/events');
+    Object.entries(handlers).forEach(([type, handler]) => {
+        source.addEventListener(type, event => handler(JSON.parse(event.data)));
+    });
+
+    return source;
+}
+
+// Check whether an event's date falls in the given year (and month, if any)
+function isInPeriod(dateString, year, month) {
+    const [eventYear, eventMonth] = dateString.split('-').map(Number);
+    return eventYear === Number(year) && (month === undefined || eventMonth === Number(month));
+}
+
+// Show an alert when a budget threshold has been crossed
+function showBudgetAlert(event) {
+    const alertDiv = document.createElement('div');
+    alertDiv.className = `alert ${event.threshold >= 100 ? 'alert-danger' : 'alert-warning'} alert-dismissible fade show`;
+    alertDiv.textContent = `Budget "${event.name}" reached ${event.threshold}%: $${event.spent.toFixed(2)} of $${event.amount.toFixed(2)} spent.`;
+
+    const closeButton = document.createElement('button');
+    closeButton.type = 'button';
+    closeButton.className = 'btn-close';
+    closeButton.setAttribute('data-bs-dismiss', 'alert');
+    alertDiv.appendChild(closeButton);
+
+    const container = document.querySelector('.container');
+    container.insertBefore(alertDiv, container.firstChild);
+}
@@ -0,0 +1,196 @@
+"""Template fragment caching, a shared bytecode cache and render timing.
+
+Expensive template blocks can be wrapped in a cache tag:
+
+    {% cache 'yearly-expenses', year %} ... {% endcache %}
+
+The fragment is stored per user and keyed by the user's data version, which is
+bumped in user_data_versions whenever a commit touches one of the user's tenant
+rows. Any change therefore invalidates the user's fragments in every worker.
+The same row carries a categories version that only moves when the user's
+categories change (see category_cache.py).
+
+Compiled templates go to a filesystem bytecode cache that all gunicorn workers
+share: TEMPLATE_CACHE_DIR, or else Jinja's private per-user directory in the
+temp dir. Every render is timed, logged and reported in the Server-Timing
+response header.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import sqlalchemy as sa
+from flask import before_render_template, g, has_request_context, template_rendered
+from flask_login import current_user
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from sharding import SHARDED_TABLES
+
+logger = logging.getLogger(__name__)
+
+class FragmentCache:
+    """Small thread-safe LRU store for rendered fragments"""
+
+    def __init__(self, max_entries=2048):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+class FragmentCacheExtension(Extension):
+    """Adds the {% cache key, ... %}...{% endcache %} tag"""
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key_parts = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key_parts.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method('_render_cached', [nodes.List(key_parts)]), [], [], body
+        ).set_lineno(lineno)
+
+    def _render_cached(self, key_parts, caller):
+        cache = self.environment.fragment_cache
+        if cache is None or not has_request_context() or not current_user.is_authenticated:
+            return caller()
+
+        key = (current_user.id, data_version(current_user.id), *key_parts)
+        fragment = cache.get(key)
+        if fragment is None:
+            fragment = caller()
+            cache.set(key, fragment)
+        return fragment
+
+def _versions(user_id):
+    from app import db
+    from models import UserDataVersion
+
+    versions = g.setdefault('data_versions', {})
+    if user_id not in versions:
+        row = db.session.get(UserDataVersion, user_id)
+        versions[user_id] = (row.version, row.categories_version) if row else (0, 0)
+    return versions[user_id]
+
+def data_version(user_id):
+    """Get the current data version of a user, read once per request"""
+    return _versions(user_id)[0]
+
+def categories_version(user_id):
+    """Get the version of a user's categories, read with the data version"""
+    return _versions(user_id)[1]
+
+def touch_user_data(session, user_ids, categories=False):
+    """Mark users whose data changed outside the ORM unit of work (e.g. bulk inserts)"""
+    session.info.setdefault('touched_users', set()).update(user_ids)
+    if categories:
+        session.info.setdefault('touched_categories', set()).update(user_ids)
+
+def _collect_touched_users(session, flush_context):
+    touched = session.info.setdefault('touched_users', set())
+    touched_categories = session.info.setdefault('touched_categories', set())
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        table_name = instance.__class__.__table__.name
+        if table_name in SHARDED_TABLES:
+            touched.add(instance.user_id)
+            if table_name == 'categories':
+                touched_categories.add(instance.user_id)
+
+def _bump_data_versions(session):
+    from app import db
+    from models import UserDataVersion
+
+    user_ids = session.info.pop('touched_users', None)
+    category_user_ids = session.info.pop('touched_categories', None) or set()
+    if not user_ids:
+        return
+
+    table = UserDataVersion.__table__
+    # The committed session can't run SQL any more, so use a connection of our own
+    with db.engine.begin() as conn:
+        for user_id in user_ids:
+            category_step = 1 if user_id in category_user_ids else 0
+            bump = sa.update(table).where(table.c.user_id == user_id).values(
+                version=table.c.version + 1,
+                categories_version=table.c.categories_version + category_step,
+            )
+            if not conn.execute(bump).rowcount:
+                try:
+                    with conn.begin_nested():
+                        conn.execute(sa.insert(table).values(
+                            user_id=user_id, version=1, categories_version=category_step
+                        ))
+                except IntegrityError:
+                    # Another worker created the row first
+                    conn.execute(bump)
+    if has_request_context():
+        g.pop('data_versions', None)
+
+def _forget_touched_users(session, previous_transaction):
+    session.info.pop('touched_users', None)
+    session.info.pop('touched_categories', None)
+
+def _start_render_timer(sender, template, context, **extra):
+    g.setdefault('render_started', []).append(time.perf_counter())
+
+def _record_render_time(sender, template, context, **extra):
+    started = g.get('render_started')
+    if not started:
+        return
+    elapsed_ms = (time.perf_counter() - started.pop()) * 1000
+    g.setdefault('render_times', []).append((template.name, elapsed_ms))
+    logger.debug("Rendered %s in %.1f ms", template.name, elapsed_ms)
+
+def init_templating(app):
+    """Set up fragment caching, the bytecode cache and render timing"""
+    cache_dir = os.environ.get('TEMPLATE_CACHE_DIR')
+    if cache_dir:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+    else:
+        # Jinja checks that its default directory is owned by us and private, so
+        # nobody else can plant compiled templates in it
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
+
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.jinja_env.fragment_cache = FragmentCache(int(os.environ.get('FRAGMENT_CACHE_SIZE', 2048)))
+
+    sa.event.listen(Session, 'after_flush', _collect_touched_users)
+    sa.event.listen(Session, 'after_commit', _bump_data_versions)
+    sa.event.listen(Session, 'after_soft_rollback', _forget_touched_users)
+
+    before_render_template.connect(_start_render_timer, app)
+    template_rendered.connect(_record_render_time, app)
+
+    @app.after_request
+    def add_render_timing(response):
+        render_times = g.pop('render_times', None)
+        if render_times:
+            response.headers.add('Server-Timing', ', '.join(
+                f'tpl{i};desc="{name}";dur={elapsed_ms:.1f}'
+                for i, (name, elapsed_ms) in enumerate(render_times)
+            ))
+        return response
@@ -0,0 +1,99 @@
+"""The dashboard loads every widget with a single query (see dashboard_data.py).
+
+The app is configured from the environment when it is imported, so each case
+runs in a fresh interpreter against its own temporary SQLite databases.
+"""
+import json
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COUNT_DASHBOARD_QUERIES = textwrap.dedent("""
+    import json
+    from datetime import date
+
+    import sqlalchemy as sa
+
+    from main import app
+    from app import db
+    from models import Category, User
+    from sharding import shard_for_user, use_shard
+    import routes
+
+    with app.app_context():
+        users = [User(email=f"user{n}@example.com") for n in range(8)]
+        for user in users:
+            user.set_password('secret1')
+        db.session.add_all(users)
+        db.session.commit()
+        # With sharding on, pick a user whose data lives on the extra shard
+        router = app.extensions.get('shard_router')
+        user = next((u for u in users if router and router.shard_for(u.id) != 'default'), users[0])
+        email, user_id = user.email, user.id
+
+    client = app.test_client()
+    client.post('/login', data={'email': email, 'password': 'secret1'})
+    client.get('/dashboard')  # Creates the default categories
+
+    with app.app_context():
+        with use_shard(shard_for_user(user_id)):
+            category_id = Category.query.filter_by(user_id=user_id).first().id
+    today = date.today()
+    client.post('/budgets/add', data={'name': 'Food', 'amount': '100', 'period': 'monthly',
+                                      'year': today.year, 'month': today.month, 'category_id': category_id})
+    for amount in ('85', '10', '4'):
+        client.post('/expenses/add', data={'amount': amount, 'description': 'x',
+                                           'date': today.isoformat(), 'category_id': category_id})
+    client.get('/dashboard')  # Warm the per-process caches
+
+    statements = []
+    def count(*args, **kwargs):
+        statements.append(phase[0])
+    with app.app_context():
+        for engine in db.engines.values():
+            sa.event.listen(engine, 'before_cursor_execute', count)
+
+    phase = ['view']
+    load_dashboard = routes.load_dashboard
+    def counted_load_dashboard(*args, **kwargs):
+        phase[0] = 'load_dashboard'
+        try:
+            return load_dashboard(*args, **kwargs)
+        finally:
+            phase[0] = 'view'
+    routes.load_dashboard = counted_load_dashboard
+
+    response = client.get('/dashboard')
+    print(json.dumps({
+        'status': response.status_code,
+        'load_dashboard': statements.count('load_dashboard'),
+        'total': len(statements),
+        'budget_shown': b'Food' in response.data,
+    }))
+""")
+
+def count_dashboard_queries(tmp_path, sharded):
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{tmp_path / 'main.db'}", SESSION_SECRET='test',
+               LOG_LEVEL='ERROR', TEMPLATE_CACHE_DIR=str(tmp_path / 'jinja'))
+    env.pop('SHARD_DATABASE_URLS', None)
+    if sharded:
+        env['SHARD_DATABASE_URLS'] = f"shard1=sqlite:///{tmp_path / 'shard1.db'}"
+    result = subprocess.run([sys.executable, '-c', COUNT_DASHBOARD_QUERIES], cwd=ROOT, env=env,
+                            capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+@pytest.mark.parametrize('sharded', [False, True], ids=['single-database', 'sharded'])
+def test_dashboard_widgets_load_in_one_query(tmp_path, sharded):
+    counts = count_dashboard_queries(tmp_path, sharded)
+
+    assert counts['status'] == 200
+    assert counts['budget_shown']
+    assert counts['load_dashboard'] == 1
+    # Around the widget query: user load, data version and, when sharded, the shard assignment
+    assert counts['total'] <= 4
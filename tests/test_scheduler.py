@@ -0,0 +1,121 @@
+"""Materializing recurring expenses (see scheduler.py).
+
+Like test_dashboard.py, each case runs in a fresh interpreter because the app
+is configured from the environment when it is imported.
+"""
+import json
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MATERIALIZE = textwrap.dedent("""
+    import json
+    import sys
+    from datetime import date
+    from decimal import Decimal
+
+    from main import app
+    from app import db
+    from models import Budget, BudgetAlert, Category, Expense, RecurringExpense, User
+    from scheduler import materialize_due_expenses
+    from sharding import shard_for_user, use_shard
+
+    batch_size = int(sys.argv[1])
+
+    with app.app_context():
+        user = User(email='user@example.com')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+
+        sharded = 'shard_router' in app.extensions
+        with use_shard(shard_for_user(user_id) if sharded else 'default'):
+            category = Category(name='Bills', user_id=user_id)
+            db.session.add(category)
+            db.session.flush()
+
+            def rule(description, amount, rule, next_run, **kwargs):
+                return RecurringExpense(description=description, amount=Decimal(amount), rule=rule,
+                                        next_run=next_run, anchor_day=next_run.day,
+                                        user_id=user_id, category_id=category.id, **kwargs)
+
+            def budget(name, amount, period, month=None):
+                return Budget(name=name, amount=Decimal(amount), period=period, year=2026, month=month,
+                              user_id=user_id, category_id=category.id)
+
+            db.session.add_all([
+                rule('Rent', '50.00', 'monthly', date(2026, 1, 31)),
+                rule('Gym', '10.00', 'weekly', date(2026, 3, 2), end_date=date(2026, 3, 20)),
+                rule('Insurance', '12.34', 'yearly', date(2024, 2, 29)),
+                rule('Paused', '99.00', 'monthly', date(2026, 1, 1), is_active=False),
+                rule('Later', '99.00', 'monthly', date(2026, 5, 1)),
+                budget('February', '60.00', 'monthly', month=2),
+                budget('March', '100.00', 'monthly', month=3),
+                budget('Year', '1000.00', 'yearly'),
+            ])
+            db.session.commit()
+
+            created = materialize_due_expenses(date(2026, 4, 15), batch_size)
+            created_again = materialize_due_expenses(date(2026, 4, 15), batch_size)
+
+            expenses = [[expense.description, expense.date.isoformat(), str(expense.amount)]
+                        for expense in Expense.query.order_by(Expense.description, Expense.date)]
+            rules = {rule.description: [rule.next_run.isoformat(), rule.is_active]
+                     for rule in RecurringExpense.query}
+            budgets = {budget.name: str(budget.spent) for budget in Budget.query}
+            alerts = sorted([alert.budget.name, alert.threshold] for alert in BudgetAlert.query)
+
+    print(json.dumps({'created': created, 'created_again': created_again, 'expenses': expenses,
+                      'rules': rules, 'budgets': budgets, 'alerts': alerts}))
+""")
+
+def materialize(tmp_path, sharded, batch_size):
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{tmp_path / 'main.db'}", SESSION_SECRET='test',
+               LOG_LEVEL='ERROR', TEMPLATE_CACHE_DIR=str(tmp_path / 'jinja'))
+    env.pop('SHARD_DATABASE_URLS', None)
+    if sharded:
+        env['SHARD_DATABASE_URLS'] = f"shard1=sqlite:///{tmp_path / 'shard1.db'}"
+    result = subprocess.run([sys.executable, '-c', MATERIALIZE, str(batch_size)], cwd=ROOT, env=env,
+                            capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+@pytest.mark.parametrize('sharded', [False, True], ids=['single-database', 'sharded'])
+@pytest.mark.parametrize('batch_size', [1, 500], ids=['batch-1', 'batch-500'])
+def test_due_rules_are_caught_up(tmp_path, sharded, batch_size):
+    result = materialize(tmp_path, sharded, batch_size)
+
+    assert result['expenses'] == [
+        # Weekly until the end date
+        ['Gym', '2026-03-02', '10.00'],
+        ['Gym', '2026-03-09', '10.00'],
+        ['Gym', '2026-03-16', '10.00'],
+        # Leap day anchor, clamped to Feb 28 in common years
+        ['Insurance', '2024-02-29', '12.34'],
+        ['Insurance', '2025-02-28', '12.34'],
+        ['Insurance', '2026-02-28', '12.34'],
+        # Clamped to the end of February, then back on the 31st
+        ['Rent', '2026-01-31', '50.00'],
+        ['Rent', '2026-02-28', '50.00'],
+        ['Rent', '2026-03-31', '50.00'],
+    ]
+    assert result['created'] == 9
+    assert result['created_again'] == 0
+    assert result['rules'] == {
+        'Rent': ['2026-04-30', True],
+        'Gym': ['2026-03-23', False],  # Past its end date
+        'Insurance': ['2027-02-28', True],
+        'Paused': ['2026-01-01', False],
+        'Later': ['2026-05-01', True],
+    }
+    assert result['budgets'] == {
+        'February': '62.34',
+        'March': '80.00',
+        'Year': '192.34',
+    }
+    assert result['alerts'] == [['February', 80], ['February', 100], ['March', 80]]
@@ -0,0 +1,171 @@
+"""Moving users between shards and assigning them one (see sharding.py).
+
+Like test_dashboard.py, each case runs in a fresh interpreter because the app
+is configured from the environment when it is imported.
+"""
+import json
+import os
+import subprocess
+import sys
+import textwrap
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MOVE_USER = textwrap.dedent("""
+    import json
+    from datetime import date
+    from decimal import Decimal
+
+    import sqlalchemy as sa
+
+    from main import app
+    from app import db
+    from models import Budget, BudgetAlert, Category, Expense, RecurringExpense, User
+    from sharding import mark_moving, move_user, shard_engine, use_shard
+
+    def snapshot(shard_key, user_id):
+        # Joins drop rows whose references don't resolve on the shard, and rows are
+        # compared by name, so remapped ids look the same as the originals
+        tables = db.metadata.tables
+        categories, expenses, budgets = tables['categories'], tables['expenses'], tables['budgets']
+        alerts, recurring = tables['budget_alerts'], tables['recurring_expenses']
+        with shard_engine(shard_key).connect() as conn:
+            def rows(query):
+                return sorted([str(value) for value in row] for row in conn.execute(query))
+            return {
+                'category_ids': sorted(conn.scalars(sa.select(categories.c.id).where(categories.c.user_id == user_id))),
+                'expenses': rows(sa.select(expenses.c.description, expenses.c.amount, categories.c.name)
+                                 .join(categories, (categories.c.id == expenses.c.category_id)
+                                       & (categories.c.user_id == user_id))
+                                 .where(expenses.c.user_id == user_id)),
+                'budgets': rows(sa.select(budgets.c.name, budgets.c.amount, budgets.c.spent, categories.c.name)
+                                .join(categories, (categories.c.id == budgets.c.category_id)
+                                      & (categories.c.user_id == user_id))
+                                .where(budgets.c.user_id == user_id)),
+                'alerts': rows(sa.select(alerts.c.threshold, alerts.c.spent, budgets.c.name)
+                               .join(budgets, (budgets.c.id == alerts.c.budget_id) & (budgets.c.user_id == user_id))
+                               .where(alerts.c.user_id == user_id)),
+                'recurring': rows(sa.select(recurring.c.description, categories.c.name)
+                                  .join(categories, (categories.c.id == recurring.c.category_id)
+                                        & (categories.c.user_id == user_id))
+                                  .where(recurring.c.user_id == user_id)),
+                'expense_total': str(conn.scalar(sa.select(sa.func.coalesce(sa.func.sum(expenses.c.amount), 0))
+                                                 .where(expenses.c.user_id == user_id))),
+                'rows_left': sum(conn.scalar(sa.select(sa.func.count()).where(tables[name].c.user_id == user_id))
+                                 for name in ('categories', 'expenses', 'budgets', 'budget_alerts',
+                                              'recurring_expenses')),
+            }
+
+    with app.app_context():
+        mover, other = User(email='mover@example.com'), User(email='other@example.com')
+        db.session.add_all([mover, other])
+        db.session.commit()
+        mover_id, other_id = mover.id, other.id
+
+        # Another user's categories on the target take the ids the mover has on the source
+        with use_shard('shard1'):
+            db.session.add_all(Category(name=f"Other {n}", user_id=other_id) for n in range(3))
+            db.session.commit()
+
+        today = date.today()
+        with use_shard('default'):
+            food, rent = Category(name='Food', user_id=mover_id), Category(name='Rent', user_id=mover_id)
+            db.session.add_all([food, rent])
+            db.session.flush()
+            food_budget = Budget(name='Food budget', amount=Decimal('100.00'), period='monthly', year=today.year,
+                                 month=today.month, spent=Decimal('85.50'), user_id=mover_id, category_id=food.id)
+            rent_budget = Budget(name='Rent budget', amount=Decimal('900.00'), period='monthly', year=today.year,
+                                 month=today.month, spent=Decimal('900.00'), user_id=mover_id, category_id=rent.id)
+            db.session.add_all([food_budget, rent_budget])
+            db.session.flush()
+            db.session.add_all([
+                Expense(amount=Decimal('60.25'), description='Groceries', date=today, user_id=mover_id,
+                        category_id=food.id),
+                Expense(amount=Decimal('25.25'), description='Lunch', date=today, user_id=mover_id,
+                        category_id=food.id),
+                Expense(amount=Decimal('900.00'), description='Flat', date=today, user_id=mover_id,
+                        category_id=rent.id),
+                BudgetAlert(threshold=80, spent=Decimal('85.50'), user_id=mover_id, budget_id=food_budget.id),
+                BudgetAlert(threshold=100, spent=Decimal('900.00'), user_id=mover_id, budget_id=rent_budget.id),
+                RecurringExpense(amount=Decimal('900.00'), description='Flat', rule='monthly', anchor_day=1,
+                                 next_run=today, user_id=mover_id, category_id=rent.id),
+            ])
+            db.session.commit()
+
+        before = snapshot('default', mover_id)
+        mark_moving(db, {mover_id: 'default'})
+        moved = move_user(db, mover_id, 'default', 'shard1')
+        after = snapshot('shard1', mover_id)
+        source_after = snapshot('default', mover_id)
+
+    print(json.dumps({'moved': moved, 'before': before, 'after': after, 'source_rows_left': source_after['rows_left']}))
+""")
+
+CONCURRENT_ASSIGNMENT = textwrap.dedent("""
+    import json
+
+    import sqlalchemy as sa
+    from flask import g
+
+    from main import app
+    from app import db
+    from models import ShardAssignment, User
+    from sharding import shard_for_user
+
+    with app.app_context():
+        user = User(email='user@example.com')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+
+        router = app.extensions['shard_router']
+        ring_shard = router.shard_for(user_id)
+        other_shard = 'shard1' if ring_shard == 'default' else 'default'
+        shard_for = router.shard_for
+
+        def racing_shard_for(user_id):
+            # Another worker's first request commits the assignment in between
+            with db.engine.begin() as conn:
+                conn.execute(sa.insert(ShardAssignment.__table__).values(user_id=user_id, shard_key=other_shard))
+            return shard_for(user_id)
+        router.shard_for = racing_shard_for
+
+        shard_key = shard_for_user(user_id)
+        router.shard_for = shard_for
+        stored = db.session.get(ShardAssignment, user_id).shard_key
+
+    print(json.dumps({'shard_key': shard_key, 'stored': stored, 'other_shard': other_shard}))
+""")
+
+def run_script(tmp_path, script):
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{tmp_path / 'main.db'}", SESSION_SECRET='test',
+               LOG_LEVEL='ERROR', TEMPLATE_CACHE_DIR=str(tmp_path / 'jinja'),
+               SHARD_DATABASE_URLS=f"shard1=sqlite:///{tmp_path / 'shard1.db'}")
+    result = subprocess.run([sys.executable, '-c', script], cwd=ROOT, env=env,
+                            capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def test_move_user_remaps_ids_and_keeps_totals(tmp_path):
+    result = run_script(tmp_path, MOVE_USER)
+    before, after = result['before'], result['after']
+
+    # 2 categories, 2 budgets, 3 expenses, 2 alerts and 1 recurring expense
+    assert result['moved'] == 10
+    # The target's first ids were taken, so every reference had to be remapped
+    assert before['category_ids'] == [1, 2]
+    assert after['category_ids'] == [4, 5]
+    for key in ('expenses', 'budgets', 'alerts', 'recurring'):
+        assert after[key] == before[key]
+    assert len(after['expenses']) == 3
+    assert len(after['budgets']) == 2
+    assert len(after['alerts']) == 2
+    assert len(after['recurring']) == 1
+    assert after['expense_total'] == before['expense_total'] == '985.50'
+    assert result['source_rows_left'] == 0
+
+def test_concurrent_first_requests_share_one_assignment(tmp_path):
+    result = run_script(tmp_path, CONCURRENT_ASSIGNMENT)
+
+    # The losing request uses the assignment that was committed first instead of failing
+    assert result['shard_key'] == result['stored'] == result['other_shard']